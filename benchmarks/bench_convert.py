@@ -0,0 +1,82 @@
+"""Benchmark: single-pass graph rewriting in convert_amr_to_events.
+
+Run from the repository root:
+    python -m benchmarks.bench_convert
+
+Events of the single-pass rewrite engine are checked against the separate
+rules (golden output) on test_samples/amr_with_align.txt and recur.txt,
+and on random graphs with nested "and" nodes, reentrancies and ARGN-of edges.
+"""
+import random
+import timeit
+
+from utils.amrgraph import AMRGraph, AMRNode, align_graph
+from utils.convert_amr_to_event import convert_amr_to_events
+
+SAMPLES = ["test_samples/amr_with_align.txt", "test_samples/recur.txt"]
+VALUES = ["and", "and", "go-01", "say-01", "want-01", "person", "thing", "have-rel-role-91"]
+ROLES = [":ARG0", ":ARG1", ":ARG2", ":ARG0-of", ":ARG1-of", ":op1", ":op2", ":mod", ":time", ":name"]
+
+
+def event_outputs(events):
+    """Events as comparable values, including spans and head positions."""
+    return [(e.to_json(), [(r.span, r.head_pos) for r in e.roles]) for e in events]
+
+
+def load_sample(fpath, alignments):
+    """Parse a sample graph."""
+    with open(fpath, "r") as f:
+        return AMRGraph.parse(f.read().strip(), alignments)
+
+
+def random_graph(seed, node_num=40, token_num=60):
+    """Random graph, the same for the same seed."""
+    rng = random.Random(seed)
+    nodes = [AMRNode(id_=f"n{i}", value=rng.choice(VALUES), token_num=token_num)
+             for i in range(node_num)]
+    for _ in range(node_num * 2):
+        head = rng.choice(nodes)
+        if rng.random() < 0.1:
+            head.add_relation(":polarity", "-")
+        else:
+            head.add_relation(rng.choice(ROLES), rng.choice(nodes))
+    for node in nodes:
+        node.update_pos(rng.randrange(token_num))
+    nodes[0].update_scope_from_children()
+    return AMRGraph(nodes=nodes, id2node={n.id: n for n in nodes}, root=nodes[0],
+                    tokens=[f"w{i}" for i in range(token_num)])
+
+
+def check(make_graph):
+    """Compare events of both ways on fresh graphs, return the events."""
+    single = event_outputs(convert_amr_to_events(make_graph(), single_pass=True))
+    separate = event_outputs(convert_amr_to_events(make_graph(), single_pass=False))
+    assert single == separate
+    return single
+
+
+def bench(make_graph, number=200):
+    """Time both ways of rewriting, graph construction included."""
+    single = min(timeit.repeat(lambda: convert_amr_to_events(make_graph(), single_pass=True),
+                               number=number, repeat=3))
+    separate = min(timeit.repeat(lambda: convert_amr_to_events(make_graph(), single_pass=False),
+                                 number=number, repeat=3))
+    return separate / number, single / number
+
+
+if __name__ == "__main__":
+    cases = []
+    for fpath in SAMPLES:
+        with open(fpath, "r") as f:
+            alignments = align_graph(f.read().strip())
+        cases.append((fpath, lambda fpath=fpath, alignments=alignments: load_sample(fpath, alignments)))
+    for fpath, make_graph in cases:
+        print(f"{fpath}: {len(check(make_graph))} events identical")
+    for seed in range(1000):
+        check(lambda: random_graph(seed))
+    print("1000 random graphs: events identical")
+    cases.append(("random", lambda: random_graph(0, node_num=400, token_num=200)))
+    print(f"{'graph':>32} {'separate(ms)':>13} {'single(ms)':>11}")
+    for name, make_graph in cases:
+        separate, single = bench(make_graph)
+        print(f"{name:>32} {separate * 1000:>13.3f} {single * 1000:>11.3f}")
@@ -0,0 +1,83 @@
+"""Benchmark: Document.from_file throughput over a directory of event files.
+
+Run from the repository root:
+    python -m benchmarks.bench_document_load [event_dir]
+
+Without event_dir, synthetic documents are written to a temporary directory.
+Documents are loaded twice, trusting the persisted entity heads and salient
+mentions, and with those fields dropped, so that they are recomputed.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from utils.narrative.document import Document
+from utils.narrative.entity import _content_words
+
+WORDS = ["the", "man", "a", "woman", "he", "she", "police", "officer", "city",
+         "of", "new", "york", "it", "company", "his", "mother", "x", "president"]
+
+
+def synthetic_documents(doc_dir, num_docs=2000, seed=0):
+    """Write random event documents under doc_dir."""
+    rng = random.Random(seed)
+    for i in range(num_docs):
+        entities = []
+        for ent_id in range(rng.randint(1, 10)):
+            mentions = [[rng.choice(WORDS) for _ in range(rng.randint(1, 5))]
+                        for _ in range(rng.randint(1, 6))]
+            entities.append({"mentions": mentions, "ent_id": ent_id, "concept": "person"})
+        events = []
+        for sent_id in range(rng.randint(1, 30)):
+            roles = [{"role": rng.choice([":ARG0", ":ARG1", ":ARG2"]),
+                      "value": [rng.choice(WORDS)],
+                      "concept": "thing",
+                      "ent_id": rng.choice([None] + [e["ent_id"] for e in entities])}
+                     for _ in range(rng.randint(0, 3))]
+            events.append({"pb_frame": "say.01", "verb_pos": 0, "sent_id": sent_id, "roles": roles})
+        # Persist entities the same way step 6 does
+        doc = Document.from_json({"doc_id": f"doc{i}", "entities": entities, "events": events})
+        with open(os.path.join(doc_dir, f"doc{i}.txt"), "w") as f:
+            f.write(json.dumps(doc.to_json()))
+
+
+def list_files(doc_dir):
+    """List event files under doc_dir."""
+    return [os.path.join(root, f)
+            for root, dirs, files in os.walk(doc_dir)
+            for f in files if f.endswith(".txt")]
+
+
+def load_recompute(fpath):
+    """Load a document with entity heads and salient mentions dropped."""
+    with open(fpath, "r") as f:
+        doc = json.load(f)
+    for e in doc["entities"]:
+        e.pop("head", None)
+        e.pop("salient_mention", None)
+    return Document.from_json(doc)
+
+
+def bench(files, load):
+    """Return documents per second."""
+    _content_words.cache_clear()
+    start = time.perf_counter()
+    for fpath in files:
+        load(fpath)
+    return len(files) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        files = list_files(sys.argv[1])
+        trusted, recomputed = bench(files, Document.from_file), bench(files, load_recompute)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic_documents(tmp_dir)
+            files = list_files(tmp_dir)
+            trusted, recomputed = bench(files, Document.from_file), bench(files, load_recompute)
+    print(f"{'docs':>8} {'trusted(doc/s)':>16} {'recompute(doc/s)':>18} {'speedup':>8}")
+    print(f"{len(files):>8} {trusted:>16.1f} {recomputed:>18.1f} {trusted / recomputed:>8.2f}")
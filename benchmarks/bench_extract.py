@@ -0,0 +1,60 @@
+"""Benchmark: streaming extraction of Gigaword documents in step 1.
+
+Run from the repository root:
+    python -m benchmarks.bench_extract
+
+Documents of iter_story_documents are checked against the BeautifulSoup
+extraction it replaces, on a synthetic Gigaword file with non-ascii text
+(utf-8, multi-byte characters across parser buffer boundaries),
+non-story documents and entities, and both ways are timed.
+"""
+import gzip
+import io
+import random
+import timeit
+
+import bs4
+
+from step_1 import iter_story_documents
+
+WORDS = ["The", "café", "—", "naïve", "résumé", "Zürich", "said", "“quoted”", "&amp;", "Mr.", "€5", "日本"]
+TYPES = ["story", "story", "story", "advis", "multi"]
+
+
+def synthetic_gigaword(num_docs=2000, seed=0):
+    """Gigaword-like file content in utf-8 bytes."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        paragraphs = "".join([
+            "<P>\n" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))) + "\n</P>\n"
+            for _ in range(rng.randint(1, 8))])
+        docs.append(f'<DOC id="NYT_ENG_{i:08d}" type="{rng.choice(TYPES)}">\n'
+                    f"<HEADLINE>\n{rng.choice(WORDS)}\n</HEADLINE>\n"
+                    f"<DATELINE>\nNEW YORK\n</DATELINE>\n"
+                    f"<TEXT>\n{paragraphs}</TEXT>\n</DOC>\n")
+    return "".join(docs).encode("utf-8")
+
+
+def extract_bs4(data):
+    """Story documents as extracted before streaming."""
+    dom = bs4.BeautifulSoup(data, "lxml")
+    return [(doc["id"], doc.find("text").get_text()) for doc in dom.find_all("doc", type="story")]
+
+
+def extract_stream(gz_data):
+    """Story documents of iter_story_documents from gzip content."""
+    with gzip.open(io.BytesIO(gz_data), "rb") as f:
+        return list(iter_story_documents(f))
+
+
+if __name__ == "__main__":
+    data = synthetic_gigaword()
+    gz_data = gzip.compress(data)
+    expected = extract_bs4(data)
+    assert extract_stream(gz_data) == expected
+    assert any(not text.isascii() for _, text in expected)
+    print(f"{len(expected)} story documents identical to BeautifulSoup, non-ascii included")
+    bs4_seconds = min(timeit.repeat(lambda: extract_bs4(gzip.decompress(gz_data)), number=1, repeat=3))
+    stream_seconds = min(timeit.repeat(lambda: extract_stream(gz_data), number=1, repeat=3))
+    print(f"BeautifulSoup {bs4_seconds:.3f}s, streaming {stream_seconds:.3f}s")
@@ -0,0 +1,45 @@
+"""Benchmark: import time of modules using spacy and the amr aligner.
+
+Run from the repository root:
+    python -m benchmarks.bench_import
+
+Each module is imported in a fresh interpreter, alone and followed by
+preload_models(), which loads what used to be loaded at import time.
+Also reports whether spacy and amrlib were imported.
+"""
+import json
+import subprocess
+import sys
+
+MODULES = ["utils.amrgraph", "utils.narrative.entity", "utils.narrative.document", "step_6"]
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+if {preload}:
+    from utils.amrgraph import preload_models
+    from utils.narrative.entity import load_stopwords
+    preload_models()
+    load_stopwords()
+print(json.dumps([time.perf_counter() - start, "spacy" in sys.modules, "amrlib" in sys.modules]))
+"""
+
+
+def import_time(module, preload=False, repeat=3):
+    """Min seconds to import module in a fresh interpreter, and loaded packages."""
+    results = []
+    for _ in range(repeat):
+        # No arguments for config.py to parse
+        output = subprocess.run([sys.executable, "-c", SCRIPT.format(module=module, preload=preload)],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return min(results)
+
+
+if __name__ == "__main__":
+    print(f"{'module':>26} {'import(s)':>10} {'+preload(s)':>12} {'spacy':>6} {'amrlib':>7}")
+    for module in MODULES:
+        seconds, spacy_loaded, amrlib_loaded = import_time(module)
+        preload_seconds = import_time(module, preload=True)[0]
+        print(f"{module:>26} {seconds:>10.3f} {preload_seconds:>12.3f} "
+              f"{str(spacy_loaded):>6} {str(amrlib_loaded):>7}")
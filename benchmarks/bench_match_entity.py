@@ -0,0 +1,47 @@
+"""Benchmark: coreference span lookup in step 6.
+
+Run from the repository root:
+    python -m benchmarks.bench_match_entity
+"""
+import random
+import timeit
+
+from step_6 import build_entity_index, match_entity, match_entity_by_index
+
+
+def synthetic_document(num_chains, doc_len=2000, max_mentions=8, max_span=6, seed=0):
+    """Generate random coreference chains over a document of doc_len tokens."""
+    rng = random.Random(seed)
+    entities = []
+    for _ in range(num_chains):
+        entity = []
+        for _ in range(rng.randint(1, max_mentions)):
+            start = rng.randrange(doc_len - max_span)
+            entity.append((start, start + rng.randint(1, max_span)))
+        entities.append(entity)
+    return entities
+
+
+def bench(num_chains, doc_len=2000, num_queries=2000, repeat=3):
+    """Compare linear scan and index lookup on one synthetic document."""
+    entities = synthetic_document(num_chains, doc_len=doc_len)
+    rng = random.Random(1)
+    queries = [rng.randrange(doc_len) for _ in range(num_queries)]
+    index = build_entity_index(entities)
+    for q in queries:
+        assert match_entity(q, entities) == match_entity_by_index(q, index)
+    scan = min(timeit.repeat(lambda: [match_entity(q, entities) for q in queries],
+                             number=1, repeat=repeat))
+    build = min(timeit.repeat(lambda: build_entity_index(entities),
+                              number=1, repeat=repeat))
+    lookup = min(timeit.repeat(lambda: [match_entity_by_index(q, index) for q in queries],
+                               number=1, repeat=repeat))
+    return scan, build, lookup
+
+
+if __name__ == "__main__":
+    print(f"{'chains':>8} {'scan(s)':>10} {'build(s)':>10} {'lookup(s)':>10} {'speedup':>8}")
+    for num_chains in [10, 50, 100, 200, 500]:
+        scan, build, lookup = bench(num_chains)
+        print(f"{num_chains:>8} {scan:>10.4f} {build:>10.4f} {lookup:>10.4f} "
+              f"{scan / (build + lookup):>8.1f}")
@@ -0,0 +1,98 @@
+"""Benchmark: peak RSS of keeping loaded documents in memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory [event_dir] [num_docs]
+
+Without event_dir, synthetic documents are written to a temporary directory.
+Each mode loads the documents in a fresh process: "slots" uses the
+narrative classes as they are, "dict" swaps in copies of Role, Event and
+Entity as they were before __slots__ (commit ad8e104, Role and Event are
+the same as in the baseline): attributes in an instance __dict__ and
+strings not interned. Each mode checks the layout of the loaded objects.
+"""
+import resource
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_document_load import list_files, synthetic_documents
+
+
+def peak_rss():
+    """Peak resident set size of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def use_dict_classes():
+    """Replace narrative classes used by Document with dict-backed ones."""
+    from utils.narrative import document, entity
+
+    class Role:
+        def __init__(self, role, value, concept, ent_id, **kwargs):
+            self.role = role
+            self.value = value
+            self.concept = concept
+            self.ent_id = ent_id
+
+    class Event:
+        def __init__(self, pb_frame, verb_pos, sent_id, roles):
+            self.pb_frame = pb_frame    # propbank frame
+            self.verb_pos = verb_pos
+            self.sent_id = sent_id
+            self.roles = [Role(**r) for r in roles]
+
+    class Entity:
+        def __init__(self, mentions, ent_id, head=None, salient_mention=None, concept=None):
+            self.mentions = mentions
+            self.ent_id = ent_id
+            self.head = head if head is not None else self.get_head()
+            if salient_mention is None:
+                salient_mention = self.get_salient_mention()
+            self.salient_mention = salient_mention
+            self.concept = concept
+
+        # Unchanged by __slots__, they only read attributes
+        get_head = entity.Entity.get_head
+        get_salient_mention = entity.Entity.get_salient_mention
+
+    document.Event = Event
+    document.Entity = Entity
+
+
+def check_layout(mode, doc):
+    """Check that objects of a loaded document are stored as mode says."""
+    objs = doc.entities[:1] + doc.events[:1] + [r for e in doc.events[:1] for r in e.roles[:1]]
+    for obj in objs:
+        assert (len(getattr(obj, "__dict__", {})) > 0) == (mode == "dict"), \
+            f"{type(obj).__name__} is not stored as {mode}"
+
+
+def load(mode, files):
+    """Load documents and print peak RSS before and after."""
+    from utils.narrative.document import Document
+    if mode == "dict":
+        use_dict_classes()
+    before = peak_rss()
+    docs = [Document.from_file(fpath) for fpath in files]
+    after = peak_rss()
+    check_layout(mode, next(doc for doc in docs if len(doc.events) > 0))
+    print(f"{mode:>6} {len(docs):>8} {before:>12.1f} {after:>12.1f} {after - before:>12.1f}")
+
+
+def run(doc_dir, num_docs):
+    """Run every mode in its own process."""
+    print(f"{'mode':>6} {'docs':>8} {'before(MB)':>12} {'after(MB)':>12} {'delta(MB)':>12}")
+    for mode in ["dict", "slots"]:
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_memory",
+                        "--load", mode, doc_dir, str(num_docs)], check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--load":
+        load(sys.argv[2], sorted(list_files(sys.argv[3]))[:int(sys.argv[4])])
+    elif len(sys.argv) > 1:
+        run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10 ** 9)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic_documents(tmp_dir, num_docs=20000)
+            run(tmp_dir, 20000)
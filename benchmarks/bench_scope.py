@@ -0,0 +1,127 @@
+"""Benchmark: AMR node scope propagation and span queries.
+
+Run from the repository root:
+    python -m benchmarks.bench_scope
+
+Bitmask scopes of AMRNode are checked against the list scopes they replace,
+on the graphs in test_samples and on random graphs over long sentences.
+"""
+import random
+import timeit
+
+from utils.amrgraph import ALIGNMENT_FILTER, AMRGraph, AMRNode, align_graph
+
+SAMPLES = ["test_samples/amr.txt", "test_samples/amr_with_align.txt", "test_samples/recur.txt"]
+
+
+def list_head_idx(scope):
+    """Head index of a list scope, as before bitmask scopes."""
+    for i in range(len(scope))[::-1]:
+        if scope[i]:
+            return i
+    return None
+
+
+def list_span(scope):
+    """Span of a list scope, as before bitmask scopes."""
+    start, end = None, None
+    skip = 0
+    tolerant = 1
+    for i in range(len(scope))[::-1]:
+        if end is None and scope[i]:
+            end = i + 1
+        if end is not None:
+            if scope[i]:
+                skip = 0
+                start = i
+            elif skip < tolerant:
+                skip += 1
+            else:
+                break
+    return start, end
+
+
+def list_scopes(nodes, alignments, token_num):
+    """Propagate list scopes from the root nodes[0], as before bitmask scopes."""
+    scopes = {id(node): [False] * token_num for node in nodes}
+    id2node = {node.id: node for node in reversed(nodes)}
+    for idx, id_ in alignments:
+        node = id2node[id_]
+        if node.value not in ALIGNMENT_FILTER and token_num >= idx:
+            scopes[id(node)][idx] = True
+    visited = set()
+
+    def update(node):
+        visited.add(id(node))
+        for child in node.children:
+            if isinstance(child, AMRNode) and id(child) not in visited:
+                update(child)
+        scope = scopes[id(node)]
+        for child in node.children:
+            if isinstance(child, AMRNode):
+                child_scope = scopes[id(child)]
+                for i in range(len(scope)):
+                    scope[i] = scope[i] or child_scope[i]
+
+    update(nodes[0])
+    return [(list_head_idx(scopes[id(node)]), list_span(scopes[id(node)])) for node in nodes]
+
+
+def bit_scopes(nodes, alignments, token_num):
+    """Propagate bitmask scopes from the root nodes[0]."""
+    id2node = {node.id: node for node in reversed(nodes)}
+    for node in nodes:
+        node.scope_bits = 0
+        node.visit = False
+    for idx, id_ in alignments:
+        node = id2node[id_]
+        if node.value not in ALIGNMENT_FILTER:
+            node.update_pos(idx)
+    nodes[0].update_scope_from_children()
+    return [(node.head_idx, node.span) for node in nodes]
+
+
+def load_samples():
+    """Load (nodes, alignments, token_num) of the sample graphs."""
+    graphs = []
+    for fpath in SAMPLES:
+        with open(fpath, "r") as f:
+            text = f.read().strip()
+        alignments = align_graph(text)
+        graph = AMRGraph.parse(text, alignments)
+        nodes = [graph.root] + [node for node in graph.nodes if node is not graph.root]
+        graphs.append((fpath, nodes, alignments, len(graph.tokens)))
+    return graphs
+
+
+def random_graph(token_num, node_num, seed=0):
+    """Random graph with reentrancies and one alignment per node."""
+    rng = random.Random(seed)
+    nodes = [AMRNode(id_=f"n{i}", value="thing", token_num=token_num) for i in range(node_num)]
+    for i in range(1, node_num):
+        nodes[rng.randrange(i)].add_relation(":ARG0", nodes[i])
+        if rng.random() < 0.1:
+            nodes[rng.randrange(node_num)].add_relation(":ARG1", nodes[i])
+    alignments = [(rng.randrange(token_num), node.id) for node in nodes]
+    return nodes, alignments, token_num
+
+
+def bench(nodes, alignments, token_num, repeat=5):
+    """Check bitmask scopes against list scopes and time both."""
+    assert list_scopes(nodes, alignments, token_num) == bit_scopes(nodes, alignments, token_num)
+    lists = min(timeit.repeat(lambda: list_scopes(nodes, alignments, token_num),
+                              number=1, repeat=repeat))
+    bits = min(timeit.repeat(lambda: bit_scopes(nodes, alignments, token_num),
+                             number=1, repeat=repeat))
+    return lists, bits
+
+
+if __name__ == "__main__":
+    print(f"{'graph':>32} {'tokens':>7} {'nodes':>6} {'list(ms)':>9} {'bits(ms)':>9} {'speedup':>8}")
+    cases = load_samples()
+    for token_num in [50, 200, 800]:
+        cases.append(("random", *random_graph(token_num, token_num // 2)))
+    for name, nodes, alignments, token_num in cases:
+        lists, bits = bench(nodes, alignments, token_num)
+        print(f"{name:>32} {token_num:>7} {len(nodes):>6} {lists * 1000:>9.3f} {bits * 1000:>9.3f} "
+              f"{lists / bits:>8.1f}")
@@ -30,11 +30,57 @@ def parse_args():
     parser.add_argument("--worker_id", default=0, type=int,
                         help="the worker id of this processor, used in step 3 and 4")
     parser.add_argument("--device", default=0, type=int,
-                        help="the cuda device used by this processor, used in step 3 and 4")
+                        help="the cuda device used by this processor (-1 for cpu), used in step 3 and 4")
+    parser.add_argument("--jobs", default=1, type=int,
+                        help="number of local worker processes, used in step 1, 3, 4, 6, 7, 8 and 9")
+    parser.add_argument("--devices", default=None,
+                        help="comma separated devices assigned to local workers in turn "
+                             "(-1 for cpu), used in step 3 and 4, default to --device")
+    parser.add_argument("--max_tokens", default=4000, type=int,
+                        help="max padded tokens per amr parser batch, used in step 3")
+    parser.add_argument("--coref_max_tokens", default=0, type=int,
+                        help="max padded tokens per coreference batch, "
+                             "0 to predict documents one by one, used in step 4")
+    parser.add_argument("--coref_window", default=1500, type=int,
+                        help="documents longer than this are split into segments "
+                             "in batched coreference, used in step 4")
+    parser.add_argument("--coref_overlap", default=200, type=int,
+                        help="overlapped tokens of adjacent segments in batched coreference, used in step 4")
+    parser.add_argument("--storage", default="file", choices=["file", "shard"],
+                        help="document storage of each step, "
+                             "one file per document or packed jsonl shards")
+    parser.add_argument("--manifest", action="store_true",
+                        help="look up and record document status in <work_dir>/manifest.sqlite "
+                             "instead of checking output files, used in step 1, 2, 3, 4 and 6")
+    parser.add_argument("--split_mode", default="copy", choices=["copy", "hardlink", "symlink", "list"],
+                        help="how documents are put into rich_docs/<split>, links need file storage, "
+                             "\"list\" writes event keys to rich_docs/<split>.list instead, used in step 7")
+    parser.add_argument("--parse_cache", action="store_true",
+                        help="look up and save amr graphs of sentences in <work_dir>/amr_cache.sqlite, "
+                             "so that repeated sentences are parsed once, used in step 3 and the pipeline")
+    parser.add_argument("--preload_models", action="store_true",
+                        help="load spacy model, amr aligner and stop words before starting "
+                             "pool workers, so that forked workers share them, used in step 6")
+    parser.add_argument("--pipeline_parser", default="amrlib", choices=["amrlib", "stub"],
+                        help="amr parser of the streaming pipeline, "
+                             "\"stub\" parses every sentence to a placeholder graph")
+    parser.add_argument("--pipeline_coref", default="allennlp", choices=["allennlp", "stub"],
+                        help="coreference model of the streaming pipeline, "
+                             "\"stub\" clusters repeated capitalized tokens")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="also save intermediate results of the streaming pipeline "
+                             "to the step directories")
+    parser.add_argument("--queue_size", default=2, type=int,
+                        help="max number of batches waiting before each stage of the streaming pipeline")
     parser.add_argument("--seed", default=10000019, type=int,
                         help="the random seed when generating questions.")
     parser.add_argument("--num_questions", default=10000, type=int,
                         help="number of questions to be sampled.")
+    parser.add_argument("--per_question_seed", action="store_true",
+                        help="derive one random stream per question from --seed, "
+                             "so that questions do not depend on --jobs, used in step 9")
+    parser.add_argument("--questions_jsonl", action="store_true",
+                        help="write each question set to one jsonl file, used in step 9")
     return parser.parse_args()
 
 
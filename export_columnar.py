@@ -0,0 +1,34 @@
+"""Export event documents to columnar stores, see utils/narrative/columnar.py."""
+import logging
+import os
+
+from tqdm import tqdm
+
+from config import CONFIG
+from utils.common import open_split_store, open_store
+from utils.narrative.columnar import convert_store
+
+
+def export_columnar(work_dir, storage="file"):
+    """Convert event/ and rich_docs/{train,dev,test} (if split) to columnar stores.
+
+    Stores are saved to <work_dir>/columnar/<same relative path>.
+    """
+    sources = {"event": open_store(os.path.join(work_dir, "event"), storage)}
+    for split in ["train", "dev", "test"]:
+        src = os.path.join("rich_docs", split)
+        if os.path.exists(os.path.join(work_dir, src)) \
+                or os.path.exists(os.path.join(work_dir, f"{src}.list")):
+            sources[src] = open_split_store(work_dir, split, storage)
+    for src, in_store in sources.items():
+        logging.info(f"Converting {src} to columnar store.")
+        out_dir = os.path.join(work_dir, "columnar", src)
+        with tqdm() as pbar:
+            total = convert_store(in_store, out_dir, pbar=pbar)
+        logging.info(f"Totally {total} docs saved to {out_dir}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+    export_columnar(CONFIG.work_dir, storage=CONFIG.storage)
@@ -0,0 +1,304 @@
+"""Streaming pipeline: tokenize, parse, align, coref and extract in one pass.
+
+Batches of documents flow through the stages in this process, each stage
+runs in its own thread, and stages are connected by bounded queues.
+Only event documents are saved, intermediate results are saved
+to the step directories (tokenized/, amr/, align/, coref/) with checkpoint.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from tqdm import tqdm
+
+from config import CONFIG
+from utils.common import batchify, log_worker_report, open_store, pending_keys
+from utils.manifest import Manifest
+from utils.parse_cache import ParseCache, log_cache_stats
+
+logger = logging.getLogger(__name__)
+
+# Stage names, each is also the field of documents it fills in,
+#   and the step directory of its checkpoint
+STAGES = ["tokenized", "amr", "align", "coref", "event"]
+# End of stream marker
+_DONE = object()
+
+
+class StubParser:
+    """Stand-in for amr parser, parses every sentence to a placeholder graph."""
+
+    def parse_sents(self, sents):
+        from step_3 import placeholder_graph
+        return [placeholder_graph(sent) for sent in sents]
+
+
+class StubPredictor:
+    """Stand-in for coreference model, clusters repeated capitalized tokens."""
+
+    def predict_tokenized(self, tokenized_document):
+        clusters = {}
+        for idx, token in enumerate(tokenized_document):
+            if token[:1].isupper():
+                clusters.setdefault(token, []).append([idx, idx])
+        return {"clusters": [chain for chain in clusters.values() if len(chain) > 1]}
+
+
+class StubAligner:
+    """Stand-in for amr aligner, aligns no token in any graph.
+
+    Used with the stub parser, whose placeholder graphs have nothing to align,
+    so that the stub pipeline needs neither amrlib nor spacy lemmatization.
+    """
+
+    def align_docs(self, amr_texts):
+        return ["\n".join(["" for _ in amr_text.split("\n\n")]) for amr_text in amr_texts]
+
+
+class _FieldView:
+    """Read a field of in-flight documents like a document store."""
+
+    def __init__(self, docs, field):
+        self.docs = docs
+        self.field = field
+
+    def read(self, key):
+        return self.docs[key][self.field]
+
+
+def tokenize_stage():
+    """Build the tokenize stage, raw -> tokenized."""
+    from step_2 import batch_tokenize_spacy, load_tokenizer, preprocess_text
+    nlp = load_tokenizer()
+
+    def run(docs):
+        texts = [preprocess_text(doc["raw"]) for doc in docs]
+        for doc, tokenized in zip(docs, batch_tokenize_spacy(texts, nlp)):
+            doc["tokenized"] = tokenized
+    return run
+
+
+def parse_stage(parser="amrlib", device=0, max_tokens=4000, failure_path=None,
+                cache=None, stats=None):
+    """Build the parse stage, tokenized -> amr.
+
+    :param parser: "amrlib", or "stub" for placeholder graphs.
+    :param cache: ParseCache, or None, see batch_parse_amrlib.
+    :param stats: Counter of parse cache, see batch_parse_amrlib.
+    """
+    from step_3 import batch_parse_amrlib, load_parser, save_parse_failures
+    model = StubParser() if parser == "stub" else load_parser(device)
+
+    def run(docs):
+        sents = [doc["tokenized"].strip().splitlines() for doc in docs]
+        results, failures = batch_parse_amrlib(sents, model, max_tokens, cache, stats)
+        for doc, result in zip(docs, results):
+            doc["amr"] = result
+        save_parse_failures(failure_path, [doc["key"] for doc in docs], sents, failures)
+    return run
+
+
+def align_stage(aligner="amrlib"):
+    """Build the align stage, amr -> align.
+
+    :param aligner: "amrlib", or "stub" to align no token.
+    """
+    if aligner == "stub":
+        align_docs = StubAligner().align_docs
+    else:
+        from step_3 import align_docs
+
+    def run(docs):
+        for doc, align_text in zip(docs, align_docs([doc["amr"] for doc in docs])):
+            doc["align"] = align_text
+    return run
+
+
+def coref_stage(coref="allennlp", device=0, model_path=None):
+    """Build the coref stage, tokenized -> coref.
+
+    :param coref: "allennlp", or "stub" for string match clusters.
+    """
+    import step_4
+    if coref == "stub":
+        predictor = StubPredictor()
+    else:
+        step_4.init_predictor(device, model_path)
+        predictor = step_4._PREDICTOR
+
+    def run(docs):
+        for doc in docs:
+            try:
+                doc["coref"] = step_4.predict_coref(predictor, doc["tokenized"].strip().split())
+            except (RuntimeError, IndexError, ValueError) as e:
+                doc["error"] = f"coref: {e!r}"
+    return run
+
+
+def extract_stage(work_dir, event_store):
+    """Build the extract stage, saves event documents."""
+    from step_6 import extract_doc, load_frame_list
+    frame_list = load_frame_list(work_dir)
+
+    def run(docs):
+        docs = {doc["key"]: doc for doc in docs}
+        stores = {name: _FieldView(docs, name) for name in ["tokenized", "amr", "align", "coref"]}
+        stores["event"] = event_store
+        for key, doc in docs.items():
+            try:
+                extract_doc(stores, key, frame_list, check=False)
+                doc["event"] = True
+            except Exception as e:
+                doc["error"] = f"event: {e!r}"
+    return run
+
+
+def _run_stage(name, func, in_queue, out_queue, checkpoint_store, timing):
+    """Apply func to each batch from in_queue and pass it to out_queue.
+
+    Documents failed in previous stages are skipped,
+    if func or checkpoint raises an error, all documents of the batch fail.
+    Stages saved to checkpoint_store are added to the "saved" set of each document.
+    """
+    while True:
+        batch = in_queue.get()
+        if batch is _DONE:
+            out_queue.put(_DONE)
+            return
+        docs = [doc for doc in batch if "error" not in doc]
+        start = time.perf_counter()
+        try:
+            if len(docs) > 0:
+                func(docs)
+            if checkpoint_store is not None:
+                for doc in docs:
+                    if "error" not in doc:
+                        checkpoint_store.write(doc["key"], doc[name])
+                        doc.setdefault("saved", set()).add(name)
+        except Exception as e:
+            logger.exception(f"Stage {name} failed.")
+            for doc in docs:
+                doc["error"] = f"{name}: {e!r}"
+        timing[name] += time.perf_counter() - start
+        out_queue.put(batch)
+
+
+def stream(batches, stages, queue_size=2, checkpoint_stores=None, timing=None):
+    """Pass batches through stages, yield batches in order.
+
+    :param batches: iterable of document batches, a document is a dict
+        with "key" and the fields needed by the first stage.
+    :param stages: list of (name, func), func fills in field name of documents.
+    :param queue_size: max number of batches waiting before each stage.
+    :param checkpoint_stores: dict, stage name -> store to save its field to.
+    :param timing: Counter, stage name -> seconds, updated in place.
+    """
+    checkpoint_stores = checkpoint_stores or {}
+    timing = timing if timing is not None else Counter()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def feed():
+        try:
+            for batch in batches:
+                queues[0].put(batch)
+        except Exception:
+            logger.exception("Reading documents failed.")
+        finally:
+            queues[0].put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, (name, func) in enumerate(stages):
+        threads.append(threading.Thread(
+            target=_run_stage,
+            args=(name, func, queues[i], queues[i + 1], checkpoint_stores.get(name), timing),
+            daemon=True))
+    for thread in threads:
+        thread.start()
+    while True:
+        batch = queues[-1].get()
+        if batch is _DONE:
+            break
+        yield batch
+    for thread in threads:
+        thread.join()
+
+
+def run_pipeline(work_dir, batch_size=32, device=0, max_tokens=4000, coref_model_path=None,
+                 parser="amrlib", coref="allennlp", checkpoint=False, queue_size=2,
+                 storage="file", manifest=None, cache=False):
+    """Extract events from raw documents in one pass.
+
+    :param parser: "amrlib", or "stub" for placeholder graphs, which are not aligned.
+    :param coref: "allennlp", or "stub" for string match clusters.
+    :param checkpoint: also save intermediate results to the step directories.
+    :param queue_size: max number of batches waiting before each stage.
+    :param manifest: if given, look up and record document status in it.
+    :param cache: look up and save graphs of sentences in <work_dir>/amr_cache.sqlite,
+        not used with the stub parser.
+    """
+    raw_store = open_store(os.path.join(work_dir, "raw"), storage)
+    event_store = open_store(os.path.join(work_dir, "event"), storage)
+    keys = pending_keys(raw_store, event_store, manifest=manifest,
+                        in_stage="raw", out_stage="event")
+    logger.info(f"{len(keys)} documents to process.")
+    # Placeholder graphs of the stub parser must not be cached
+    parse_cache = ParseCache.from_work_dir(work_dir) if cache and parser != "stub" else None
+    cache_stats = Counter()
+    stages = [
+        ("tokenized", tokenize_stage()),
+        ("amr", parse_stage(parser, device, max_tokens,
+                            os.path.join(work_dir, "amr_failures.jsonl"),
+                            parse_cache, cache_stats)),
+        ("align", align_stage("stub" if parser == "stub" else "amrlib")),
+        ("coref", coref_stage(coref, device, coref_model_path)),
+        ("event", extract_stage(work_dir, event_store)),
+    ]
+    checkpoint_stores = {
+        name: open_store(os.path.join(work_dir, name), storage)
+        for name in STAGES[:-1]
+    } if checkpoint else None
+    # Read documents lazily, at most queue_size batches ahead of tokenizer
+    batches = ([{"key": key, "raw": raw_store.read(key)} for key in batch]
+               for batch in batchify(keys, batch_size))
+    timing = Counter()
+    report = {os.getpid(): [device, 0, [], timing]}
+    with tqdm(total=len(keys)) as pbar:
+        for batch in stream(batches, stages, queue_size, checkpoint_stores, timing):
+            succeeded = [doc["key"] for doc in batch if "error" not in doc]
+            failed = [(doc["key"], doc["error"]) for doc in batch if "error" in doc]
+            report[os.getpid()][1] += len(succeeded)
+            report[os.getpid()][2].extend(failed)
+            if manifest is not None:
+                if checkpoint:
+                    # Only stages whose checkpoint is written
+                    for name in STAGES[:-1]:
+                        manifest.mark(name, [doc["key"] for doc in batch
+                                             if name in doc.get("saved", ())])
+                manifest.mark("event", succeeded)
+                manifest.mark_failed("event", failed)
+            pbar.update(len(batch))
+    if parse_cache is not None:
+        log_cache_stats(cache_stats, logger)
+    log_worker_report(report, logger)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+    logging.getLogger("penman").setLevel(logging.CRITICAL)
+    logging.getLogger("amrlib").setLevel(logging.CRITICAL)
+    logging.getLogger("allennlp").setLevel(logging.CRITICAL)
+    run_pipeline(CONFIG.work_dir,
+                 device=CONFIG.device,
+                 max_tokens=CONFIG.max_tokens,
+                 coref_model_path=CONFIG.coref_model_path or None,
+                 parser=CONFIG.pipeline_parser,
+                 coref=CONFIG.pipeline_coref,
+                 checkpoint=CONFIG.checkpoint,
+                 queue_size=CONFIG.queue_size,
+                 storage=CONFIG.storage,
+                 manifest=Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None,
+                 cache=CONFIG.parse_cache)
@@ -2,11 +2,14 @@
 import gzip
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import bs4
+from lxml import etree
 from tqdm import tqdm
 
 from config import CONFIG
+from utils.common import open_store
+from utils.manifest import Manifest
 
 
 logger = logging.getLogger(__name__)
@@ -28,39 +31,79 @@ def qualified_files(file_list, start_year=1994, end_year=2004):
     return result
 
 
-def extract_documents(corp_dir, work_dir, start_year=1994, end_year=2004):
-    """Extract documents."""
+def iter_story_documents(f):
+    """Iterate (doc_id, text) of story documents in a gigaword file stream.
+
+    Documents are parsed one by one with the lxml html parser
+    (the same parser used by BeautifulSoup with "lxml"),
+    and released after use, so that memory usage stays constant.
+    Gigaword files are utf-8, the html parser would assume latin-1 otherwise.
+    """
+    for _, doc in etree.iterparse(f, events=("end",), tag="doc", html=True, encoding="utf-8"):
+        if doc.get("type") == "story":
+            text = doc.find(".//text")
+            text = "".join(text.itertext()) if text is not None else ""
+            yield doc.get("id"), text
+        # Release parsed documents
+        doc.clear()
+        while doc.getprevious() is not None:
+            del doc.getparent()[0]
+
+
+def extract_gz(gzip_path, raw_store, subdir):
+    """Extract story documents in a gzip file into subdir of raw store.
+
+    Return keys of extracted documents.
+    """
+    keys = []
+    with gzip.open(gzip_path, "rb") as f:
+        for doc_id, text in iter_story_documents(f):
+            # write to store
+            key = f"{subdir}/{doc_id}.txt"
+            raw_store.write(key, text)
+            keys.append(key)
+    return keys
+
+
+def extract_documents(corp_dir, work_dir, start_year=1994, end_year=2004, jobs=1,
+                      storage="file", manifest=None):
+    """Extract documents.
+
+    :param jobs: number of gzip files extracted at once.
+    :param storage: output storage, "file" or "shard".
+    :param manifest: if given, record extracted documents in it.
+    """
     gz_dir = os.path.join(corp_dir, "data/nyt_eng")
     gz_list = qualified_files(os.listdir(gz_dir),
                               start_year=start_year,
                               end_year=end_year)
     # extract documents
     total_docs = 0
-    raw_dir = os.path.join(work_dir, "raw")
-    if not os.path.exists(raw_dir):
-        os.makedirs(raw_dir)
+    raw_store = open_store(os.path.join(work_dir, "raw"), storage)
     with tqdm(total=len(gz_list)) as pbar:
-        for gz in gz_list:
-            pbar.set_description("Extracting {}".format(gz))
-            gzip_path = os.path.join(gz_dir, gz)
-            subdir = os.path.join(raw_dir, gz.replace(".gz", ""))
-            if not os.path.exists(subdir):
-                os.makedirs(subdir)
-            with gzip.open(gzip_path, "rb") as f:
-                dom = bs4.BeautifulSoup(f.read(), "lxml")
-            for doc in dom.find_all("doc", type="story"):
-                # find doc content
-                doc_id = doc["id"]
-                headline = doc.find("headline")
-                dateline = doc.find("dateline")
-                text = doc.find("text").get_text()
-                # write to file
-                file_path = os.path.join(subdir, f"{doc_id}.txt")
-                with open(file_path, "w") as f:
-                    f.write(text)
-                # doc counter
-                total_docs += 1
-            pbar.update(1)
+        if jobs <= 1:
+            for gz in gz_list:
+                pbar.set_description("Extracting {}".format(gz))
+                gzip_path = os.path.join(gz_dir, gz)
+                keys = extract_gz(gzip_path, raw_store, gz.replace(".gz", ""))
+                if manifest is not None:
+                    manifest.mark("raw", keys)
+                total_docs += len(keys)
+                pbar.update(1)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(extract_gz,
+                                    os.path.join(gz_dir, gz),
+                                    raw_store,
+                                    gz.replace(".gz", ""))
+                    for gz in gz_list]
+                for future in as_completed(futures):
+                    keys = future.result()
+                    if manifest is not None:
+                        manifest.mark("raw", keys)
+                    total_docs += len(keys)
+                    pbar.update(1)
     logger.info(f"Totally {total_docs} docs extracted.")
 
 
@@ -69,4 +112,7 @@ if __name__ == "__main__":
                         level=logging.INFO)
     extract_documents(corp_dir=CONFIG.corp_dir, work_dir=CONFIG.work_dir,
                       start_year=CONFIG.start_year,
-                      end_year=CONFIG.end_year)
+                      end_year=CONFIG.end_year,
+                      jobs=CONFIG.jobs,
+                      storage=CONFIG.storage,
+                      manifest=Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None)
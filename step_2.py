@@ -8,7 +8,8 @@ import spacy
 from tqdm import tqdm
 
 from config import CONFIG
-from utils.common import map_input_output
+from utils.common import open_store, pending_keys
+from utils.manifest import Manifest
 
 logger = logging.getLogger(__name__)
 
@@ -61,40 +62,43 @@ def batch_tokenize_spacy(docs, nlp):
     return out_docs
 
 
-def tokenize(work_dir, batch_size=100):
-    """Tokenize documents."""
+def load_tokenizer():
+    """Load spacy pipeline for sentence segmentation and tokenization."""
     exclude_components = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner"]
     nlp = spacy.load("en_core_web_sm", exclude=exclude_components)
     nlp.enable_pipe("senter")
+    return nlp
+
+
+def tokenize(work_dir, batch_size=100, storage="file", manifest=None):
+    """Tokenize documents.
+
+    :param manifest: if given, look up and record document status in it.
+    """
+    nlp = load_tokenizer()
     logger.info("Tokenizer loaded.")
     # Record all documents
-    raw_dir = os.path.join(work_dir, "raw")
-    tokenized_dir = os.path.join(work_dir, "tokenized")
-    if not os.path.exists(tokenized_dir):
-        os.makedirs(tokenized_dir)
-    in_paths, out_paths = map_input_output(raw_dir, tokenized_dir)
-    process_in, process_out = [], []
-    for fin, fout in zip(in_paths, out_paths):
-        if not os.path.exists(fout):
-            process_in.append(fin)
-            process_out.append(fout)
+    raw_store = open_store(os.path.join(work_dir, "raw"), storage)
+    tokenized_store = open_store(os.path.join(work_dir, "tokenized"), storage)
+    process_keys = pending_keys(raw_store, tokenized_store,
+                                manifest=manifest, in_stage="raw", out_stage="tokenized")
     # Tokenize documents in batches
-    tot_num = len(process_in)
+    tot_num = len(process_keys)
     batch_num = math.ceil(tot_num / batch_size)
     with tqdm(total=tot_num) as pbar:
         for batch_id in range(batch_num):
             # Read raw documents
             start_idx, end_idx = batch_id * batch_size, (batch_id+1) * batch_size
             in_docs = []
-            for fp in process_in[start_idx:end_idx]:
-                with open(fp, "r") as f:
-                    content = f.read()
+            for key in process_keys[start_idx:end_idx]:
+                content = raw_store.read(key)
                 in_docs.append(preprocess_text(content))
             # Tokenize
             out_docs = batch_tokenize_spacy(docs=in_docs, nlp=nlp)
-            for fp, content in zip(process_out[start_idx:end_idx], out_docs):
-                with open(fp, "w") as f:
-                    f.write(content)
+            for key, content in zip(process_keys[start_idx:end_idx], out_docs):
+                tokenized_store.write(key, content)
+            if manifest is not None:
+                manifest.mark("tokenized", process_keys[start_idx:end_idx])
             pbar.update(len(in_docs))
 
 
@@ -102,4 +106,6 @@ if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
                         level=logging.INFO)
     tokenize(work_dir=CONFIG.work_dir,
-             batch_size=100)
+             batch_size=100,
+             storage=CONFIG.storage,
+             manifest=Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None)
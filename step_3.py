@@ -1,124 +1,319 @@
 """Step 3: Parse documents with AMR parser."""
+import json
 import logging
-import math
 import os
+from collections import Counter
 
-import amrlib
 from tqdm import tqdm
 
-from utils.amrgraph import align_graph
+from utils.amrgraph import align_graphs
 from config import CONFIG
-from utils.common import map_input_output
+from utils.common import (batchify, log_worker_report, open_store, parse_devices,
+                          pending_keys, run_pipelined, run_tasks, token_budget_groups)
+from utils.manifest import Manifest
+from utils.parse_cache import ParseCache, log_cache_stats
 
 logger = logging.getLogger(__name__)
 
 
-def batch_parse_amrlib(docs, parser):
-    """Parse documents in batch."""
+def token_budget_batches(sents, max_tokens=4000):
+    """Group sentences of similar length into batches under a token budget.
+
+    Sentences are sorted by length, so each batch holds sentences of one
+    length bucket, and the padded size of a batch
+    (number of sentences * longest sentence) never exceeds max_tokens.
+    A sentence longer than max_tokens forms a batch by itself.
+
+    :return: list of batches, each is a list of sentence indices.
+    """
+    return token_budget_groups([len(sent.split()) for sent in sents], max_tokens)
+
+
+# Errors raised by amr parser on bad inputs
+PARSE_ERRORS = (AttributeError, RuntimeError, IndexError, TypeError)
+
+
+def placeholder_graph(sent):
+    """Placeholder graph for sentence that cannot be parsed.
+
+    It keeps sentence indices of amr files aligned with tokenized files.
+    """
+    return f"# ::snt {sent}\n# ::parse_failed true\n(a / amr-empty)"
+
+
+def parse_sents_bisect(sents, parser):
+    """Parse sentences, bisect the batch on error down to single sentences.
+
+    :return: graphs and errors, graph is None if the sentence fails.
+    """
+    try:
+        graphs = list(parser.parse_sents(sents))
+    except PARSE_ERRORS as e:
+        if len(sents) == 1:
+            return [None], [repr(e)]
+        mid = len(sents) // 2
+        left_graphs, left_errors = parse_sents_bisect(sents[:mid], parser)
+        right_graphs, right_errors = parse_sents_bisect(sents[mid:], parser)
+        return left_graphs + right_graphs, left_errors + right_errors
+    errors = ["empty graph" if graph is None else None for graph in graphs]
+    return graphs, errors
+
+
+def batch_parse_amrlib(docs, parser, max_tokens=4000, cache=None, stats=None):
+    """Parse documents in batch.
+
+    Sentences of all documents are parsed in length-sorted batches
+    under a token budget, then put back into document order.
+    Sentences that fail are replaced by placeholder graphs.
+    With cache, sentences found in it are not parsed,
+    repeated sentences are parsed once, and new graphs are added to it.
+
+    :param cache: ParseCache, or None.
+    :param stats: Counter, updated with numbers of "sents", "cache_hits" and "parsed".
+    :return: results and failures,
+        failures is a list of (doc index, sentence index, error).
+    """
     # GSII is much faster
     spans = []
     sents = []
     for doc in docs:
         spans.append((len(sents), len(doc)))
         sents.extend(doc)
-    graphs = parser.parse_sents(sents)
+    graphs = [None] * len(sents)
+    errors = [None] * len(sents)
+    # Sentence indices to parse, grouped by sentence
+    if cache is None:
+        groups = [[idx] for idx in range(len(sents))]
+    else:
+        indices = {}
+        for idx, sent in enumerate(sents):
+            indices.setdefault(sent, []).append(idx)
+        cached = cache.get_many(list(indices))
+        groups = []
+        for sent, idxs in indices.items():
+            if sent in cached:
+                for idx in idxs:
+                    graphs[idx] = cached[sent]
+            else:
+                groups.append(idxs)
+    to_parse = [sents[idxs[0]] for idxs in groups]
+    new_graphs = []
+    for batch in token_budget_batches(to_parse, max_tokens):
+        batch_graphs, batch_errors = parse_sents_bisect([to_parse[i] for i in batch], parser)
+        for i, graph, error in zip(batch, batch_graphs, batch_errors):
+            for idx in groups[i]:
+                graphs[idx] = graph if error is None else placeholder_graph(sents[idx])
+                errors[idx] = error
+            # Failed sentences are not cached, they may succeed next time
+            if error is None:
+                new_graphs.append((to_parse[i], graph))
+    if cache is not None and len(new_graphs) > 0:
+        cache.put_many(new_graphs)
+    if stats is not None:
+        stats["sents"] += len(sents)
+        stats["cache_hits"] += len(sents) - sum([len(idxs) for idxs in groups])
+        stats["parsed"] += len(to_parse)
     results = []
-    for start, offset in spans:
+    failures = []
+    for doc_idx, (start, offset) in enumerate(spans):
         # results.append("\n".join(graphs[start:start+offset]))   # for gsii
         results.append("\n\n".join(graphs[start:start+offset]))   # for t5 and spring
-    return results
+        for sent_id in range(offset):
+            if errors[start + sent_id] is not None:
+                failures.append((doc_idx, sent_id, errors[start + sent_id]))
+    return results, failures
 
 
-def parse(work_dir, batch_size=10, workers=1, worker_id=0, device=0):
-    """Parse documents."""
-    logger.info("Parsing documents with amr parser")
+def load_parser(device=0):
+    """Load amr parser on device, -1 means cpu."""
+    # Imported here, so that other steps can use this module without amrlib
+    import amrlib
     # parser = amrlib.load_stog_model(batch_size=5000)    # for gsii
-    parser = amrlib.load_stog_model(device=device)   # for t5 and spring
-    tokenized_dir = os.path.join(work_dir, "tokenized")
-    amr_dir = os.path.join(work_dir, "amr")
-    if not os.path.exists(amr_dir):
-        os.makedirs(amr_dir)
-    in_paths, out_paths = map_input_output(tokenized_dir, amr_dir)
-    in_paths = [_ for idx, _ in enumerate(in_paths) if (idx % workers) == worker_id]
-    out_paths = [_ for idx, _ in enumerate(out_paths) if (idx % workers) == worker_id]
+    device = "cpu" if device < 0 else device
+    return amrlib.load_stog_model(device=device)   # for t5 and spring
+
+
+# Parser of this process, its token budget, failure manifest path
+#   and parse cache, set by init_parser
+_PARSER = None
+_MAX_TOKENS = 4000
+_FAILURE_PATH = None
+_CACHE = None
+
+
+def init_parser(device=0, max_tokens=4000, failure_path=None, cache=None):
+    """Load parser for this process."""
+    global _PARSER, _MAX_TOKENS, _FAILURE_PATH, _CACHE
+    _PARSER = load_parser(device)
+    _MAX_TOKENS = max_tokens
+    _FAILURE_PATH = failure_path
+    _CACHE = cache
+
+
+def save_parse_failures(failure_path, keys, docs, failures):
+    """Append failed sentences to the failure manifest, one json object per line.
+
+    :param failures: list of (doc index, sentence index, error),
+        see batch_parse_amrlib.
+    """
+    if len(failures) == 0 or failure_path is None:
+        return
+    lines = "".join([
+        json.dumps({"doc": keys[doc_idx],
+                    "sent_id": sent_id,
+                    "sentence": docs[doc_idx][sent_id],
+                    "error": error}) + "\n"
+        for doc_idx, sent_id, error in failures])
+    # Append in one write, so that workers do not interleave lines
+    with open(failure_path, "a") as f:
+        f.write(lines)
+
+
+def parse_batches(in_store, out_store, batches):
+    """Parse batches of documents and save results.
+
+    A reader thread prefetches the next batches and a writer thread
+    saves results in order, so that disk I/O overlaps with parsing.
+    Failed sentences are recorded in the failure manifest,
+    one json object per line.
+
+    :param in_store: tokenized document store.
+    :param out_store: amr document store.
+    :param batches: list of document key lists.
+    :return: (succeeded keys, failed (key, reason) pairs,
+        phase seconds and parse cache counts, see batch_parse_amrlib)
+    """
+    stats = Counter()
+
+    def read(keys):
+        return [in_store.read(key).strip().splitlines() for key in keys]
+
+    def infer(keys, docs):
+        return batch_parse_amrlib(docs, _PARSER, _MAX_TOKENS, _CACHE, stats)
+
+    def write(keys, docs, parsed):
+        results, failures = parsed
+        for key, result in zip(keys, results):
+            out_store.write(key, result)
+        save_parse_failures(_FAILURE_PATH, keys, docs, failures)
+        return keys
+
+    timing = Counter()
+    succeeded = []
+    for keys in run_pipelined(batches, read, infer, write, timing=timing):
+        succeeded.extend(keys)
+    if _CACHE is not None:
+        timing.update(stats)
+    return succeeded, [], timing
+
+
+def parse(work_dir, batch_size=100, workers=1, worker_id=0, device=0,
+          jobs=1, devices=None, max_tokens=4000, storage="file", manifest=None,
+          batches_per_task=4, cache=False):
+    """Parse documents.
+
+    Sentences of batch_size documents are grouped by length into
+    parser batches of at most max_tokens (padded) tokens.
+    Sentences that cannot be parsed are listed in amr_failures.jsonl.
+    Read/parse/write time of each worker is logged.
+
+    :param jobs: if larger than 1, spawn jobs local worker processes
+        that share one work queue, instead of workers/worker_id sharding.
+    :param devices: devices assigned to local workers in turn.
+    :param storage: document storage, "file" or "shard".
+    :param manifest: if given, look up and record document status in it.
+    :param batches_per_task: number of batches in a task,
+        reading and writing overlap with parsing inside a task.
+    :param cache: look up and save graphs of sentences
+        in <work_dir>/amr_cache.sqlite, shared by all workers.
+    """
+    logger.info("Parsing documents with amr parser")
+    tokenized_store = open_store(os.path.join(work_dir, "tokenized"), storage)
+    amr_store = open_store(os.path.join(work_dir, "amr"), storage)
+    failure_path = os.path.join(work_dir, "amr_failures.jsonl")
     # Filter parsed docs
-    process_in, process_out = [], []
-    for fin, fout in zip(in_paths, out_paths):
-        if not os.path.exists(fout):
-            process_in.append(fin)
-            process_out.append(fout)
+    if jobs > 1:
+        workers, worker_id = 1, 0
+    keys = pending_keys(tokenized_store, amr_store, workers, worker_id,
+                        manifest, "tokenized", "amr")
+    tasks = [(tokenized_store, amr_store, batches)
+             for batches in batchify(batchify(keys, batch_size), batches_per_task)]
     # Parse
-    error_in_paths = []
-    error_out_paths = []
-    tot_num = len(process_in)
-    success_num = 0
-    with tqdm(total=tot_num) as pbar:
-        for i in range(math.ceil(tot_num / batch_size)):
-            start, end = i * batch_size, (i+1) * batch_size
-            docs = []
-            for fp in process_in[start:end]:
-                with open(fp, "r") as f:
-                    content = f.read().strip().splitlines()
-                docs.append(content)
-            try:
-                results = batch_parse_amrlib(docs, parser)
-                for idx, fp in enumerate(process_out[start:end]):
-                    with open(fp, "w") as f:
-                        f.write(results[idx])
-                        success_num += 1
-                pbar.update(batch_size)
-            except (AttributeError, RuntimeError, IndexError, TypeError):
-                # logger.info("Parse error detected.")
-                error_in_paths.extend(process_in[start:end])
-                error_out_paths.extend(process_out[start:end])
-    # Re-do error batches
-    error_files = []
-    for fp_i, fp_o in zip(error_in_paths, error_out_paths):
-        with open(fp_i, "r") as f:
-            content = f.read().splitlines()
-        try:
-            results = batch_parse_amrlib([content], parser)
-            with open(fp_o, "w") as f:
-                f.write(results[0])
-                success_num += 1
-        except (AttributeError, RuntimeError, IndexError, TypeError):
-            error_files.append(fp_i)
-    logger.info(f"Totally {success_num} docs succeeded, {len(error_files)} failed.")
-    logger.info("\n" + "\n".join(error_files))
-
-
-def align(work_dir, workers=1, worker_id=0):
-    """Align amr graphs to sentences."""
+    with tqdm(total=len(keys)) as pbar:
+        report = run_tasks(parse_batches, tasks, jobs,
+                           devices=devices or [device],
+                           initializer=init_parser,
+                           initargs=(max_tokens, failure_path,
+                                     ParseCache.from_work_dir(work_dir) if cache else None),
+                           pbar=pbar,
+                           on_result=manifest.recorder("amr") if manifest else None)
+    if cache:
+        # Cache counts are reported apart from phase seconds
+        stats = Counter()
+        for worker in report.values():
+            for name in ["sents", "cache_hits", "parsed"]:
+                stats[name] += worker[3].pop(name, 0)
+        log_cache_stats(stats, logger)
+    log_worker_report(report, logger)
+
+
+def align_docs(amr_texts):
+    """Align amr graphs of documents, sentences are lemmatized together.
+
+    :param amr_texts: amr document contents.
+    :return: alignment document contents.
+    """
+    spans = []
+    graphs = []
+    for amr_text in amr_texts:
+        doc_graphs = amr_text.split("\n\n")
+        spans.append((len(graphs), len(doc_graphs)))
+        graphs.extend(doc_graphs)
+    results = align_graphs(graphs)
+    align_texts = []
+    for offset, length in spans:
+        align_results = []
+        for result in results[offset:offset+length]:
+            result = "\t".join([f"{idx} {short}" for idx, short in result])
+            align_results.append(result)
+        align_texts.append("\n".join(align_results))
+    return align_texts
+
+
+def align_batch(in_store, out_store, keys):
+    """Align amr graphs of a batch of documents and save results.
+
+    :param in_store: amr document store.
+    :param out_store: alignment document store.
+    :param keys: document keys.
+    :return: (succeeded keys, failed (key, reason) pairs)
+    """
+    align_texts = align_docs([in_store.read(key) for key in keys])
+    for key, align_text in zip(keys, align_texts):
+        out_store.write(key, align_text)
+    return keys, []
+
+
+def align(work_dir, workers=1, worker_id=0, batch_size=10, jobs=1, storage="file",
+          manifest=None):
+    """Align amr graphs to sentences.
+
+    Sentences of batch_size documents are lemmatized together.
+    """
     logger.info("Aligning amr graphs to sentences")
     # set directories
-    amr_dir = os.path.join(work_dir, "amr")
-    align_dir = os.path.join(work_dir, "align")
-    if not os.path.exists(align_dir):
-        os.makedirs(align_dir)
-    # map input and output paths
-    in_paths, out_paths = map_input_output(amr_dir, align_dir)
-    in_paths = [_ for idx, _ in enumerate(in_paths) if (idx % workers) == worker_id]
-    out_paths = [_ for idx, _ in enumerate(out_paths) if (idx % workers) == worker_id]
-    # Filter parsed docs
-    process_in, process_out = [], []
-    for fin, fout in zip(in_paths, out_paths):
-        if not os.path.exists(fout):
-            process_in.append(fin)
-            process_out.append(fout)
+    amr_store = open_store(os.path.join(work_dir, "amr"), storage)
+    align_store = open_store(os.path.join(work_dir, "align"), storage)
+    # Filter aligned docs
+    if jobs > 1:
+        workers, worker_id = 1, 0
+    keys = pending_keys(amr_store, align_store, workers, worker_id,
+                        manifest, "amr", "align")
+    batches = [(amr_store, align_store, batch) for batch in batchify(keys, batch_size)]
     # align
-    with tqdm(total=len(process_in)) as pbar:
-        for in_fp, out_fp in zip(process_in, process_out):
-            with open(in_fp, "r") as f:
-                graphs = f.read().split("\n\n")
-            align_results = []
-            for graph_string in graphs:
-                result = align_graph(graph_string)
-                result = "\t".join([f"{i} {s}" for i, s in result])
-                align_results.append(result)
-            with open(out_fp, "w") as f:
-                f.write("\n".join(align_results))
-            # update progress bar
-            pbar.update()
+    with tqdm(total=len(keys)) as pbar:
+        run_tasks(align_batch, batches, jobs, devices=[-1], pbar=pbar,
+                  on_result=manifest.recorder("align") if manifest else None)
 
 
 if __name__ == "__main__":
@@ -126,11 +321,21 @@ if __name__ == "__main__":
                         level=logging.INFO)
     logging.getLogger("penman").setLevel(logging.CRITICAL)
     logging.getLogger("amrlib").setLevel(logging.CRITICAL)
+    manifest = Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None
     parse(CONFIG.work_dir,
-          batch_size=10,
+          batch_size=100,
           workers=CONFIG.workers,
           worker_id=CONFIG.worker_id,
-          device=CONFIG.device)
+          device=CONFIG.device,
+          jobs=CONFIG.jobs,
+          devices=parse_devices(CONFIG.devices, CONFIG.device),
+          max_tokens=CONFIG.max_tokens,
+          storage=CONFIG.storage,
+          manifest=manifest,
+          cache=CONFIG.parse_cache)
     align(CONFIG.work_dir,
           workers=CONFIG.workers,
-          worker_id=CONFIG.worker_id)
+          worker_id=CONFIG.worker_id,
+          jobs=CONFIG.jobs,
+          storage=CONFIG.storage,
+          manifest=manifest)
@@ -1,60 +1,265 @@
 """Step 4: Coreference resolution."""
 import logging
 import os
-import sklearn  # avoid error when import allennlp
+from collections import Counter
 
-from allennlp.predictors import Predictor
 from tqdm import tqdm
 
 from config import CONFIG
-from utils.common import map_input_output
-
-
-def coref_resolution(work_dir, model_path=None, workers=1, worker_id=0, device=0):
-    """Coreference resolution."""
-    tokenized_dir = os.path.join(work_dir, "tokenized")
-    coref_dir = os.path.join(work_dir, "coref")
-    # Load model
-    default_model_path = "https://storage.googleapis.com/allennlp-public-models/coref-spanbert-large-2021.03.10.tar.gz"
-    model_path = model_path or default_model_path
-    model = Predictor.from_path(model_path, cuda_device=device)
-    # Map input and output paths
-    in_paths, out_paths = map_input_output(tokenized_dir, coref_dir)
-    in_paths = [_ for idx, _ in enumerate(in_paths) if (idx % workers) == worker_id]
-    out_paths = [_ for idx, _ in enumerate(out_paths) if (idx % workers) == worker_id]
+from utils.common import (batchify, log_worker_report, open_store, parse_devices,
+                          pending_keys, run_pipelined, run_tasks, token_budget_groups)
+from utils.manifest import Manifest
+
+
+DEFAULT_MODEL_PATH = "https://storage.googleapis.com/allennlp-public-models/coref-spanbert-large-2021.03.10.tar.gz"
+# Errors raised by coreference model on bad inputs
+COREF_ERRORS = (RuntimeError, IndexError, ValueError)
+# Predictor of this process and batched mode settings, set by init_predictor
+_PREDICTOR = None
+_MAX_TOKENS = 0
+_WINDOW = 0
+_OVERLAP = 0
+
+
+def init_predictor(device=0, model_path=None, max_tokens=0, window=0, overlap=0):
+    """Load coreference model for this process, device -1 means cpu.
+
+    :param max_tokens: token budget of batched mode, see predict_coref_batch.
+    :param window: max tokens of a segment in batched mode.
+    :param overlap: overlapped tokens of adjacent segments.
+    """
+    global _PREDICTOR, _MAX_TOKENS, _WINDOW, _OVERLAP
+    _MAX_TOKENS, _WINDOW, _OVERLAP = max_tokens, window, overlap
+    # Imported here, so that other steps can use this module without allennlp
+    import sklearn  # avoid error when import allennlp
+    from allennlp.predictors import Predictor
+    model_path = model_path or DEFAULT_MODEL_PATH
+    _PREDICTOR = Predictor.from_path(model_path, cuda_device=device)
+
+
+def predict_coref(predictor, tokens):
+    """Predict coreference clusters of a tokenized document.
+
+    :return: one line per cluster, "start end" spans separated by tabs.
+    """
+    # Predict raw doc
+    # result = model.predict(docuent=" ".join(content))
+    # Predict tokenized doc
+    result = predictor.predict_tokenized(tokenized_document=tokens)
+    return format_clusters(result["clusters"])
+
+
+def format_clusters(clusters):
+    """One line per cluster, "start end" spans (end exclusive) separated by tabs."""
+    return "\n".join(
+        ["\t".join([f"{start} {end+1}" for start, end in chain])
+         for chain in clusters])
+
+
+def split_segments(num_tokens, window, overlap):
+    """Start positions of segments covering a document.
+
+    Segments have window tokens, and adjacent segments share overlap tokens.
+    """
+    starts = [0]
+    if window <= 0:
+        return starts
+    step = max(window - overlap, 1)
+    while starts[-1] + window < num_tokens:
+        starts.append(starts[-1] + step)
+    return starts
+
+
+def merge_clusters(clusters):
+    """Merge clusters that share a mention span.
+
+    :param clusters: list of clusters, each is a list of (start, end) spans.
+    :return: merged clusters, spans and clusters are sorted.
+    """
+    parent = list(range(len(clusters)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for idx, cluster in enumerate(clusters):
+        for span in cluster:
+            span = tuple(span)
+            if span in owner:
+                parent[find(idx)] = find(owner[span])
+            else:
+                owner[span] = idx
+    merged = {}
+    for span, idx in owner.items():
+        merged.setdefault(find(idx), []).append(list(span))
+    return sorted([sorted(spans) for spans in merged.values()])
+
+
+def predict_coref_batch(predictor, docs, max_tokens=4000, window=0, overlap=0):
+    """Predict coreference clusters of tokenized documents in batches.
+
+    Documents longer than window tokens are split into overlapping segments.
+    Segments are sorted by length and predicted in batches of
+    at most max_tokens (padded) tokens. Clusters of segments of a document
+    are merged back by shared mention spans.
+    If a batch fails, its segments are predicted one by one.
+
+    :return: list of (result string, error), error is None if succeeded.
+    """
+    segments = []
+    for doc_idx, tokens in enumerate(docs):
+        for start in split_segments(len(tokens), window, overlap):
+            end = start + window if window > 0 else len(tokens)
+            segments.append((doc_idx, start, tokens[start:end]))
+    seg_clusters = [None] * len(segments)
+    errors = [None] * len(docs)
+    for batch in token_budget_groups([len(seg[2]) for seg in segments], max_tokens):
+        try:
+            instances = [predictor._words_list_to_instance(segments[i][2]) for i in batch]
+            results = predictor.predict_batch_instance(instances)
+            for i, result in zip(batch, results):
+                seg_clusters[i] = result["clusters"]
+        except COREF_ERRORS:
+            for i in batch:
+                try:
+                    seg_clusters[i] = predictor.predict_tokenized(
+                        tokenized_document=segments[i][2])["clusters"]
+                except COREF_ERRORS as e:
+                    errors[segments[i][0]] = repr(e)
+    doc_clusters = [[] for _ in docs]
+    doc_segments = [0] * len(docs)
+    for (doc_idx, start, tokens), clusters in zip(segments, seg_clusters):
+        doc_segments[doc_idx] += 1
+        for chain in clusters or []:
+            doc_clusters[doc_idx].append([(s + start, e + start) for s, e in chain])
+    outputs = []
+    for clusters, num, error in zip(doc_clusters, doc_segments, errors):
+        if error is not None:
+            outputs.append((None, error))
+        else:
+            # Keep the model output as is for documents in one segment
+            outputs.append((format_clusters(merge_clusters(clusters) if num > 1 else clusters), None))
+    return outputs
+
+
+def coref_docs(in_store, out_store, keys):
+    """Resolve coreference for documents one by one and save results.
+
+    A reader thread prefetches the next documents and a writer thread
+    saves results in order, so that disk I/O overlaps with prediction.
+
+    :param in_store: tokenized document store.
+    :param out_store: coreference document store.
+    :param keys: document keys.
+    :return: (succeeded keys, failed (key, reason) pairs, phase seconds)
+    """
+    def read(key):
+        return in_store.read(key).strip().split()
+
+    def infer(key, content):
+        try:
+            return predict_coref(_PREDICTOR, content), None
+        except COREF_ERRORS as e:
+            return None, repr(e)
+
+    def write(key, content, predicted):
+        result_str, error = predicted
+        if error is None:
+            out_store.write(key, result_str)
+        return key, error
+
+    timing = Counter()
+    succeeded, failed = [], []
+    for key, error in run_pipelined(keys, read, infer, write, timing=timing):
+        if error is None:
+            succeeded.append(key)
+        else:
+            failed.append((key, error))
+    return succeeded, failed, timing
+
+
+def coref_batches(in_store, out_store, batches):
+    """Resolve coreference for batches of documents and save results.
+
+    Each batch is predicted with predict_coref_batch, while a reader thread
+    prefetches the next batches and a writer thread saves results in order.
+
+    :param in_store: tokenized document store.
+    :param out_store: coreference document store.
+    :param batches: list of document key lists.
+    :return: (succeeded keys, failed (key, reason) pairs, phase seconds)
+    """
+    def read(keys):
+        return [in_store.read(key).strip().split() for key in keys]
+
+    def infer(keys, docs):
+        return predict_coref_batch(_PREDICTOR, docs, _MAX_TOKENS, _WINDOW, _OVERLAP)
+
+    def write(keys, docs, predicted):
+        failed = []
+        for key, (result_str, error) in zip(keys, predicted):
+            if error is None:
+                out_store.write(key, result_str)
+            else:
+                failed.append((key, error))
+        return keys, failed
+
+    timing = Counter()
+    succeeded, failed = [], []
+    for keys, batch_failed in run_pipelined(batches, read, infer, write, timing=timing):
+        failed_keys = set([key for key, error in batch_failed])
+        succeeded.extend([key for key in keys if key not in failed_keys])
+        failed.extend(batch_failed)
+    return succeeded, failed, timing
+
+
+def coref_resolution(work_dir, model_path=None, workers=1, worker_id=0, device=0,
+                     jobs=1, devices=None, storage="file", manifest=None, docs_per_task=32,
+                     max_tokens=0, window=1500, overlap=200, batch_size=32, batches_per_task=4):
+    """Coreference resolution.
+
+    Read/predict/write time of each worker is logged.
+
+    :param jobs: if larger than 1, spawn jobs local worker processes
+        that share one work queue, instead of workers/worker_id sharding.
+    :param devices: devices assigned to local workers in turn.
+    :param storage: document storage, "file" or "shard".
+    :param manifest: if given, look up and record document status in it.
+    :param docs_per_task: number of documents in a task,
+        reading and writing overlap with prediction inside a task.
+    :param max_tokens: if larger than 0, predict batch_size documents at a time,
+        in length-sorted model batches of at most max_tokens (padded) tokens,
+        documents longer than window tokens are split into segments
+        overlapping by overlap tokens. Otherwise predict documents one by one.
+    :param batches_per_task: number of batches of batch_size documents in a task
+        in batched mode.
+    """
+    tokenized_store = open_store(os.path.join(work_dir, "tokenized"), storage)
+    coref_store = open_store(os.path.join(work_dir, "coref"), storage)
     # Filter parsed docs
-    process_in, process_out = [], []
-    for fin, fout in zip(in_paths, out_paths):
-        if not os.path.exists(fout):
-            process_in.append(fin)
-            process_out.append(fout)
+    if jobs > 1:
+        workers, worker_id = 1, 0
+    keys = pending_keys(tokenized_store, coref_store, workers, worker_id,
+                        manifest, "tokenized", "coref")
+    if max_tokens > 0:
+        func = coref_batches
+        tasks = [(tokenized_store, coref_store, batches)
+                 for batches in batchify(batchify(keys, batch_size), batches_per_task)]
+    else:
+        func = coref_docs
+        tasks = [(tokenized_store, coref_store, batch) for batch in batchify(keys, docs_per_task)]
     # Predict
-    error_in_paths = []
-    error_out_paths = []
-    tot_num = len(process_in)
-    success_num = 0
-    with tqdm(total=len(process_in)) as pbar:
-        for in_fp, out_fp in zip(process_in, process_out):
-            with open(in_fp, "r") as f:
-                content = f.read().strip().split()
-            try:
-                # Predict raw doc
-                # result = model.predict(docuent=" ".join(content))
-                # Predict tokenized doc
-                result = model.predict_tokenized(tokenized_document=content)
-                clusters = result["clusters"]
-                result_str = "\n".join(
-                    ["\t".join([f"{start} {end+1}" for start, end in chain])
-                     for chain in clusters])
-                with open(out_fp, "w") as f:
-                    f.write(result_str)
-                success_num += 1
-            except (RuntimeError, IndexError, ValueError):
-                error_in_paths.append(in_fp)
-                error_out_paths.append(out_fp)
-            pbar.update()
-    logging.info(f"Totally {success_num} docs succeeded, {len(error_in_paths)} failed.")
-    logging.info("\n" + "\n".join(error_in_paths))
+    with tqdm(total=len(keys)) as pbar:
+        report = run_tasks(func, tasks, jobs,
+                           devices=devices or [device],
+                           initializer=init_predictor,
+                           initargs=(model_path, max_tokens, window, overlap),
+                           pbar=pbar,
+                           on_result=manifest.recorder("coref") if manifest else None)
+    log_worker_report(report)
 
 
 if __name__ == "__main__":
@@ -66,4 +271,11 @@ if __name__ == "__main__":
                      model_path=coref_model_path,
                      workers=CONFIG.workers,
                      worker_id=CONFIG.worker_id,
-                     device=CONFIG.device)
+                     device=CONFIG.device,
+                     jobs=CONFIG.jobs,
+                     devices=parse_devices(CONFIG.devices, CONFIG.device),
+                     storage=CONFIG.storage,
+                     max_tokens=CONFIG.coref_max_tokens,
+                     window=CONFIG.coref_window,
+                     overlap=CONFIG.coref_overlap,
+                     manifest=Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None)
@@ -3,13 +3,16 @@ import json
 import logging
 import os
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from tqdm import tqdm
 
 from config import CONFIG
-from utils.amrgraph import AMRGraph
+from utils.amrgraph import AMRGraph, align_stats, preload_models
+from utils.common import batchify, open_store
 from utils.convert_amr_to_event import convert_amr_to_events
-from utils.narrative.entity import Entity
+from utils.manifest import Manifest
+from utils.narrative.entity import Entity, load_stopwords
 
 
 def convert_align_info(align_text):
@@ -39,12 +42,42 @@ def match_entity(head_idx, entities):
     return ent_id, ent_span
 
 
-def merge_events_in_doc(amr_dir, align_dir, tokenized_dir, coref_dir, doc_name):
-    """Integrate information for a document."""
+def build_entity_index(entities):
+    """Build a token-position index over coreference spans.
+
+    Entry i of the index is the (ent_id, span) pair that ``match_entity``
+    would return for head index i, so each lookup takes constant time.
+    """
+    size = max((span[1] + 1 for entity in entities for span in entity), default=0)
+    index = [None] * size
+    for idx, entity in enumerate(entities):
+        for span in entity:
+            length = span[1] - span[0]
+            for pos in range(max(span[0], 0), span[1] + 1):
+                cur = index[pos]
+                # Find the smallest coref span that contains the headword
+                if cur is None or cur[1][1] - cur[1][0] > length:
+                    index[pos] = (idx, span)
+    return index
+
+
+def match_entity_by_index(head_idx, index):
+    """Match event argument head with an entity via the span index."""
+    if head_idx is None or head_idx < 0 or head_idx >= len(index):
+        return None, None
+    return index[head_idx] or (None, None)
+
+
+def merge_events_in_doc(stores, key):
+    """Integrate information for a document.
+
+    :param stores: dict of document stores, with keys
+        "amr", "align", "tokenized" and "coref".
+    :param key: document key.
+    """
     # Load coreference chain
     entities = []
-    with open(os.path.join(coref_dir, doc_name), "r") as f:
-        coref_text = f.read()
+    coref_text = stores["coref"].read(key)
     for line in coref_text.splitlines():
         spans = line.split("\t")
         entity_span = []
@@ -52,13 +85,11 @@ def merge_events_in_doc(amr_dir, align_dir, tokenized_dir, coref_dir, doc_name):
             span = span.split(" ")
             entity_span.append((int(span[0]), int(span[1])))
         entities.append(entity_span)
+    entity_index = build_entity_index(entities)
     # Load amr info
-    with open(os.path.join(amr_dir, doc_name), "r") as f:
-        amr_texts = f.read().split("\n\n")
-    with open(os.path.join(tokenized_dir, doc_name), "r") as f:
-        tokenized_texts = [sent.split() for sent in f.read().strip().split("\n")]
-    with open(os.path.join(align_dir, doc_name), "r") as f:
-        align_texts = f.read().split("\n")
+    amr_texts = stores["amr"].read(key).split("\n\n")
+    tokenized_texts = [sent.split() for sent in stores["tokenized"].read(key).strip().split("\n")]
+    align_texts = stores["align"].read(key).split("\n")
     # Sentence offset
     sent_offsets = []
     cur_pos = 0
@@ -90,7 +121,7 @@ def merge_events_in_doc(amr_dir, align_dir, tokenized_dir, coref_dir, doc_name):
             for role in event.roles:
                 if role.head_pos is not None:
                     head_idx = role.head_pos + sent_offset
-                    ent_id, span = match_entity(head_idx, entities)
+                    ent_id, span = match_entity_by_index(head_idx, entity_index)
                     if ent_id is not None:
                         # Reduce offset
                         span = (span[0] - sent_offset, span[1] - sent_offset)
@@ -122,68 +153,161 @@ def merge_events_in_doc(amr_dir, align_dir, tokenized_dir, coref_dir, doc_name):
     return doc_entities, doc_events
 
 
-def completeness_check(amr_dir, align_dir, tokenized_dir, coref_dir, doc_name):
+def completeness_check(stores, key):
     """Check information completeness."""
-    for base_dir in [amr_dir, align_dir, tokenized_dir, coref_dir]:
-        base_path = os.path.join(base_dir, doc_name)
-        if not os.path.exists(base_path):
+    for name in ["amr", "align", "tokenized", "coref"]:
+        if not stores[name].exists(key):
             return False
     return True
 
 
-def event_extraction(work_dir):
-    """Extract events."""
-    amr_dir = os.path.join(work_dir, "amr")
-    align_dir = os.path.join(work_dir, "align")
-    coref_dir = os.path.join(work_dir, "coref")
-    event_dir = os.path.join(work_dir, "event")
-    tokenized_dir = os.path.join(work_dir, "tokenized")
-    # Load propbank frame list
+def open_stores(work_dir, storage="file"):
+    """Open document stores used in event extraction."""
+    return {
+        name: open_store(os.path.join(work_dir, name), storage)
+        for name in ["amr", "align", "tokenized", "coref", "event"]
+    }
+
+
+def load_frame_list(work_dir):
+    """Load propbank frame list."""
     frame_list_path = os.path.join(work_dir, "frame.list")
     with open(frame_list_path, "r") as f:
         frame_list = set(f.read().splitlines())
+    return frame_list
+
+
+def extract_doc(stores, key, frame_list, check=True):
+    """Extract events from a single document and save to event store.
+
+    Return True if the document is complete and its events are saved.
+
+    :param check: check completeness of the document in stores.
+    """
+    if check and not completeness_check(stores, key):
+        return False
+    entities, events = merge_events_in_doc(stores, key)
+    events = sorted(events, key=lambda x: (x.sent_id, x.verb_pos))
+    # Filter the events that are out of propbank frames
+    events = [e for e in events if e.pb_frame in frame_list]
+    doc = {
+        "doc_id": os.path.basename(key).replace(".txt", ""),
+        "entities": [e.to_json() for e in entities],
+        "events": [e.to_json() for e in events]
+    }
+    stores["event"].write(key, json.dumps(doc))
+    return True
+
+
+def extract_chunk(stores, keys, frame_list, check=True):
+    """Extract a chunk of documents.
+
+    A document that raises an error fails alone, the rest of the chunk goes on.
+    Incomplete documents are neither saved nor failed.
+
+    :return: (saved keys, failed (key, reason) pairs)
+    """
+    succeeded, failed = [], []
+    for key in keys:
+        try:
+            if extract_doc(stores, key, frame_list, check):
+                succeeded.append(key)
+        except Exception as e:
+            logging.exception(f"Extracting events from {key} failed.")
+            failed.append((key, repr(e)))
+    return succeeded, failed
+
+
+# Frame list of each pool worker, loaded once by _init_worker
+_WORKER_FRAME_LIST = None
+
+
+def _init_worker(work_dir):
+    """Initialize pool worker."""
+    global _WORKER_FRAME_LIST
+    _WORKER_FRAME_LIST = load_frame_list(work_dir)
+
+
+def _extract_chunk(stores, keys, check=True):
+    """Extract a chunk of documents in pool worker."""
+    succeeded, failed = extract_chunk(stores, keys, _WORKER_FRAME_LIST, check)
+    return os.getpid(), len(keys), succeeded, failed, align_stats()
+
+
+def event_extraction(work_dir, jobs=1, chunk_size=32, storage="file", manifest=None,
+                     preload=False):
+    """Extract events.
+
+    :param work_dir: the directory to store dataset
+    :param jobs: number of worker processes, 1 to run in this process
+    :param chunk_size: number of documents per submitted task
+    :param storage: document storage, "file" or "shard"
+    :param manifest: if given, look up and record document status in it
+    :param preload: load models before starting pool workers,
+        otherwise each worker loads them on first use, e.g. the aligner
+        is never loaded if all alignments are precomputed
+    """
+    stores = open_stores(work_dir, storage)
+    # Collect unprocessed documents
+    if manifest is not None:
+        # Complete documents are done in all previous stages
+        for name in ["amr", "align", "tokenized", "coref", "event"]:
+            manifest.sync(name, stores[name])
+        complete = set(manifest.keys("amr"))
+        for name in ["align", "tokenized", "coref"]:
+            complete &= set(manifest.keys(name))
+        done = set(manifest.keys("event"))
+        done_num = len(done & complete)
+        tasks = sorted(complete - done)
+    else:
+        tasks = []
+        done_num = 0
+        for key in stores["amr"].keys():
+            if stores["event"].exists(key):
+                done_num += 1
+            else:
+                tasks.append(key)
+    check = manifest is None
+    chunks = batchify(tasks, chunk_size)
     # Build amr graph
-    with tqdm() as pbar:
-        for subdir in os.listdir(amr_dir):
-            # Prepare sub directory
-            base_amr_dir = os.path.join(amr_dir, subdir)
-            base_align_dir = os.path.join(align_dir, subdir)
-            base_tokenized_dir = os.path.join(tokenized_dir, subdir)
-            base_coref_dir = os.path.join(coref_dir, subdir)
-            base_event_dir = os.path.join(event_dir, subdir)
-            if not os.path.exists(base_event_dir):
-                os.makedirs(base_event_dir)
-            for fn in os.listdir(base_amr_dir):
-                pbar.set_description(f"Processing {fn}")
-                # Completeness check
-                out_fp = os.path.join(base_event_dir, fn)
-                if os.path.exists(out_fp):
-                    pbar.update(1)
-                    continue
-                flag = completeness_check(amr_dir=base_amr_dir,
-                                          tokenized_dir=base_tokenized_dir,
-                                          align_dir=base_align_dir,
-                                          coref_dir=base_coref_dir,
-                                          doc_name=fn)
-                if flag:
-                    entities, events = merge_events_in_doc(amr_dir=base_amr_dir,
-                                                           tokenized_dir=base_tokenized_dir,
-                                                           align_dir=base_align_dir,
-                                                           coref_dir=base_coref_dir,
-                                                           doc_name=fn)
-                    events = sorted(events, key=lambda x: (x.sent_id, x.verb_pos))
-                    # Filter the events that are out of propbank frames
-                    events = [e for e in events if e.pb_frame in frame_list]
-                    doc = {
-                        "doc_id": fn.replace(".txt", ""),
-                        "entities": [e.to_json() for e in entities],
-                        "events": [e.to_json() for e in events]
-                    }
-                    with open(out_fp, "w") as f:
-                        json.dump(doc, f)
-                else:
-                    pass
-                pbar.update(1)
+    worker_stats = {}
+    failures = []
+    with tqdm(total=done_num + len(tasks), initial=done_num) as pbar:
+        if jobs <= 1:
+            frame_list = load_frame_list(work_dir)
+            for chunk in chunks:
+                pbar.set_description(f"Processing {os.path.basename(chunk[0])}")
+                succeeded, failed = extract_chunk(stores, chunk, frame_list, check)
+                if manifest is not None:
+                    manifest.mark("event", succeeded)
+                    manifest.mark_failed("event", failed)
+                failures.extend(failed)
+                pbar.update(len(chunk))
+            worker_stats[os.getpid()] = align_stats()
+        else:
+            if preload:
+                preload_models()
+                load_stopwords()
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     initializer=_init_worker,
+                                     initargs=(work_dir,)) as executor:
+                futures = [executor.submit(_extract_chunk, stores, chunk, check)
+                           for chunk in chunks]
+                for future in as_completed(futures):
+                    pid, num, succeeded, failed, stats = future.result()
+                    if manifest is not None:
+                        manifest.mark("event", succeeded)
+                        manifest.mark_failed("event", failed)
+                    failures.extend(failed)
+                    worker_stats[pid] = stats
+                    pbar.update(num)
+    calls = sum(_["calls"] for _ in worker_stats.values())
+    hits = sum(_["cache_hits"] for _ in worker_stats.values())
+    seconds = sum(_["seconds"] for _ in worker_stats.values())
+    logging.info(f"Aligner ran {calls} times ({hits} cache hits, {seconds:.2f}s).")
+    if len(failures) > 0:
+        logging.info(f"{len(failures)} docs failed:\n"
+                     + "\n".join([f"{key}\t{reason}" for key, reason in failures]))
 
 
 if __name__ == "__main__":
@@ -191,4 +315,6 @@ if __name__ == "__main__":
                         level=logging.INFO)
     logging.getLogger("penman").setLevel(logging.CRITICAL)
     logging.getLogger("allennlp").setLevel(logging.WARNING)
-    event_extraction(CONFIG.work_dir)
+    event_extraction(CONFIG.work_dir, jobs=CONFIG.jobs, storage=CONFIG.storage,
+                     manifest=Manifest.from_work_dir(CONFIG.work_dir) if CONFIG.manifest else None,
+                     preload=CONFIG.preload_models)
@@ -2,64 +2,116 @@
 import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 from shutil import copyfile
 
 from tqdm import tqdm
 
 from config import CONFIG
+from utils.common import batchify, open_store
 
+SPLITS = ["train", "dev", "test"]
 
-def split_data(work_dir):
-    """Split train/dev/test documents."""
+
+def load_list(fpath, suffix=""):
+    """Load document list, an empty list if the file does not exist."""
+    if not os.path.exists(fpath):
+        logging.warning(f"{fpath} not found, use an empty list.")
+        return set()
+    with open(fpath, "r") as f:
+        return set([f"{fn}{suffix}" for fn in f.read().splitlines()])
+
+
+def place_docs(event_store, target_store, pairs, mode="copy"):
+    """Put documents into the split store.
+
+    :param pairs: list of (event key, file name in split store).
+    :param mode: "copy", "hardlink" or "symlink", links need file storage.
+    """
+    for key, fn in pairs:
+        # File stores copy files directly
+        if mode == "copy" and not hasattr(target_store, "path"):
+            target_store.write(fn, event_store.read(key))
+            continue
+        src, dst = event_store.path(key), target_store.path(fn)
+        # Replace documents of previous runs, also links of previous link modes,
+        #   copying onto them would fail or overwrite the event document
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if mode == "copy":
+            copyfile(src, dst)
+        elif mode == "hardlink":
+            try:
+                os.link(src, dst)
+            except OSError:
+                # e.g. work_dir spans file systems
+                copyfile(src, dst)
+        else:
+            os.symlink(os.path.abspath(src), dst)
+    return len(pairs)
+
+
+def split_data(work_dir, storage="file", mode="copy", jobs=1, chunk_size=1000):
+    """Split train/dev/test documents.
+
+    :param mode: "copy" documents, "hardlink" or "symlink" them to rich_docs/<split>,
+        or write event keys of each split to rich_docs/<split>.list ("list").
+    :param jobs: number of worker processes to place documents.
+    """
     logging.info("Splitting train/dev/test documents.")
+    if mode in ["hardlink", "symlink"] and storage != "file":
+        raise ValueError(f"Split mode {mode} needs file storage.")
     # Filter file list
-    with open("data/duplicates", "r") as f:
-        duplicates = set([f"{fn}.txt" for fn in f.read().splitlines()])
+    duplicates = load_list("data/duplicates", suffix=".txt")
     # Dev document list
-    with open("data/dev.list", "r") as f:
-        dev_list = set(f.read().splitlines())
+    dev_list = load_list("data/dev.list")
     # Test document list.
-    with open("data/test.list", "r") as f:
-        test_list = set(f.read().splitlines())
-    # Dataset directories
-    train_dir = os.path.join(work_dir, "rich_docs", "train")
-    if not os.path.exists(train_dir):
-        os.makedirs(train_dir)
-    dev_dir = os.path.join(work_dir, "rich_docs", "dev")
-    if not os.path.exists(dev_dir):
-        os.makedirs(dev_dir)
-    test_dir = os.path.join(work_dir, "rich_docs", "test")
-    if not os.path.exists(test_dir):
-        os.makedirs(test_dir)
-    # Split
-    event_dir = os.path.join(work_dir, "event")
-    total_train, total_dev, total_test = 0, 0, 0
-    with tqdm() as pbar:
-        for root, dirs, files in os.walk(event_dir):
-            for fn in files:
-                # Skip duplicate document
-                if fn in duplicates:
-                    continue
-                # Read document content
-                event_fp = os.path.join(root, fn)
-                # Save to corresponding directory
-                if fn in dev_list:
-                    target_fp = os.path.join(dev_dir, fn)
-                    total_dev += 1
-                elif fn in test_list:
-                    target_fp = os.path.join(test_dir, fn)
-                    total_test += 1
-                else:
-                    target_fp = os.path.join(train_dir, fn)
-                    total_train += 1
-                copyfile(event_fp, target_fp)
-                pbar.update()
-    logging.info(f"Totally {total_train} train docs,"
-                 f"{total_dev} dev docs,"
-                 f"{total_test} test docs.")
+    test_list = load_list("data/test.list")
+    # Assign documents
+    event_store = open_store(os.path.join(work_dir, "event"), storage)
+    split_keys = {split: [] for split in SPLITS}
+    for key in tqdm(event_store.keys()):
+        fn = os.path.basename(key)
+        # Skip duplicate document
+        if fn in duplicates:
+            continue
+        if fn in dev_list:
+            split_keys["dev"].append(key)
+        elif fn in test_list:
+            split_keys["test"].append(key)
+        else:
+            split_keys["train"].append(key)
+    # Save
+    os.makedirs(os.path.join(work_dir, "rich_docs"), exist_ok=True)
+    for split in SPLITS:
+        list_path = os.path.join(work_dir, "rich_docs", f"{split}.list")
+        if mode == "list":
+            with open(list_path, "w") as f:
+                f.write("".join([f"{key}\n" for key in split_keys[split]]))
+            continue
+        # Split list would shadow the split directory
+        if os.path.exists(list_path):
+            os.remove(list_path)
+        target_store = open_store(os.path.join(work_dir, "rich_docs", split), storage)
+        pairs = [(key, os.path.basename(key)) for key in split_keys[split]]
+        with tqdm(total=len(pairs)) as pbar:
+            if jobs <= 1:
+                pbar.update(place_docs(event_store, target_store, pairs, mode))
+            else:
+                chunks = batchify(pairs, chunk_size)
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    for num in executor.map(place_docs,
+                                            [event_store] * len(chunks),
+                                            [target_store] * len(chunks),
+                                            chunks,
+                                            [mode] * len(chunks)):
+                        pbar.update(num)
+    logging.info(f"Totally {len(split_keys['train'])} train docs,"
+                 f"{len(split_keys['dev'])} dev docs,"
+                 f"{len(split_keys['test'])} test docs.")
 
 
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
                         level=logging.INFO)
-    split_data(CONFIG.work_dir)
+    split_data(CONFIG.work_dir, storage=CONFIG.storage, mode=CONFIG.split_mode, jobs=CONFIG.jobs)
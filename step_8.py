@@ -1,34 +1,83 @@
 """Step 8: Count stop verbs."""
+import json
 import logging
 import os
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
 
 from config import CONFIG
+from utils.common import batchify, open_store
 from utils.narrative.document import Document
 
 
-def stop_list(work_dir, num_verbs=10):
-    """Generate stop list according to train documents."""
-    event_dir = os.path.join(work_dir, "event")
+def count_doc_fast(doc, counter):
+    """Count predicate-GR pairs of a json document without building objects.
+
+    Counts are updated in the same order as Document.get_chains,
+    so that ties in most_common are broken the same way.
+    """
+    predicate_grs = {}
+    for event in doc["events"]:
+        seen = set()
+        for r in event["roles"]:
+            # Same as Event.find_role, use the first role of each entity
+            ent_id = r["ent_id"]
+            if ent_id is not None and ent_id not in seen:
+                seen.add(ent_id)
+                predicate_grs.setdefault(ent_id, []).append((event["pb_frame"], r["role"]))
+    for entity in doc["entities"]:
+        counter.update(predicate_grs.get(entity["ent_id"], []))
+
+
+def count_predicate_grs(event_store, keys, fast=True):
+    """Count predicate-GR pairs of documents.
+
+    :param fast: read only needed json fields instead of building documents.
+    """
     predicate_gr_counter = Counter()
     polar_count = 0
-    with tqdm() as pbar:
-        for root, dirs, files in os.walk(event_dir):
-            for fn in files:
-                fp = os.path.join(root, fn)
-                doc = Document.from_file(fp)
-                for entity, chain in doc.get_chains():
-                    predicate_gr_counter.update([event.predicate_gr(entity) for event in chain])
-                    # for event in chain:
-                    #     for role in event.roles:
-                    #         if role.role == ":polarity":
-                    #             polar_count += 1
-                    #             print(doc.doc_id)
-                    #             print(role)
-                    #             input()
-                pbar.update(1)
+    for key in keys:
+        if fast:
+            count_doc_fast(json.loads(event_store.read(key)), predicate_gr_counter)
+            continue
+        doc = Document.from_store(event_store, key)
+        for entity, chain in doc.get_chains():
+            predicate_gr_counter.update([event.predicate_gr(entity) for event in chain])
+            # for event in chain:
+            #     for role in event.roles:
+            #         if role.role == ":polarity":
+            #             polar_count += 1
+            #             print(doc.doc_id)
+            #             print(role)
+            #             input()
+    return predicate_gr_counter
+
+
+def stop_list(work_dir, num_verbs=10, storage="file", jobs=1, chunk_size=1000, fast=True):
+    """Generate stop list according to train documents.
+
+    :param jobs: number of worker processes, each counts disjoint chunks
+        of documents, and partial counters are merged in chunk order.
+    :param fast: read only needed json fields instead of building documents.
+    """
+    event_store = open_store(os.path.join(work_dir, "event"), storage)
+    chunks = batchify(event_store.keys(), chunk_size)
+    predicate_gr_counter = Counter()
+    with tqdm(total=sum(len(chunk) for chunk in chunks)) as pbar:
+        if jobs <= 1:
+            for chunk in chunks:
+                predicate_gr_counter.update(count_predicate_grs(event_store, chunk, fast))
+                pbar.update(len(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                partial_counters = executor.map(
+                    count_predicate_grs,
+                    [event_store] * len(chunks), chunks, [fast] * len(chunks))
+                for chunk, partial_counter in zip(chunks, partial_counters):
+                    predicate_gr_counter.update(partial_counter)
+                    pbar.update(len(chunk))
     result = predicate_gr_counter.most_common(num_verbs)
     stop_list_path = os.path.join(work_dir, "stoplist.txt")
     with open(stop_list_path, "w") as f:
@@ -39,4 +88,4 @@ def stop_list(work_dir, num_verbs=10):
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
                         level=logging.INFO)
-    stop_list(CONFIG.work_dir)
+    stop_list(CONFIG.work_dir, storage=CONFIG.storage, jobs=CONFIG.jobs)
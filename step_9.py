@@ -4,51 +4,103 @@ import logging
 import math
 import os
 import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from copy import deepcopy
 
+from tqdm import tqdm
+
 from config import CONFIG
+from utils.common import batchify, open_split_store
 from utils.narrative.document import Document
 
 
-def sample_chain(doc_dir, context_size, stoplist=None):
-    """Sample a chain from a random document."""
-    entity, chain, doc = None, None, None
-    while chain is None:
-        # Randomly sample a doc
-        fn_list = list(os.listdir(doc_dir))
-        fn_path = os.path.join(doc_dir, random.choice(fn_list))
-        doc = Document.from_file(fn_path)
-        # Randomly sample a chain
-        chains = [(entity, chain) for entity, chain in doc.get_chains(stoplist=stoplist)
-                  if len(chain) > context_size]
-        if len(chains) == 0:
-            continue
+class DocumentPool:
+    """Pre-indexed pool of documents to sample chains from.
+
+    A one-time index pass records how many chains of each document are
+    longer than context_size under the stoplist, so that sampling never
+    parses a document without such chains.
+    """
+
+    def __init__(self, doc_store, context_size=8, stoplist=None, cache_size=1024):
+        self.doc_store = doc_store
+        self.context_size = context_size
+        self.stoplist = stoplist
+        self.cache_size = cache_size
+        self.keys = doc_store.keys()
+        self.num_chains = []
+        for key in tqdm(self.keys, desc="Indexing documents"):
+            doc = Document.from_store(doc_store, key)
+            self.num_chains.append(len(self.get_chains(doc)))
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        # Do not send cached documents to worker processes
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_chains(self, doc):
+        """Get (entity, chain) pairs of doc that are long enough."""
+        return [(entity, chain) for entity, chain in doc.get_chains(stoplist=self.stoplist)
+                if len(chain) > self.context_size]
+
+    def load(self, idx):
+        """Load the idx-th document, recently loaded documents are cached."""
+        if idx in self._cache:
+            self._cache.move_to_end(idx)
         else:
-            entity, chain = random.choice(chains)
-    return entity, chain, doc
+            self._cache[idx] = Document.from_store(self.doc_store, self.keys[idx])
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return self._cache[idx]
+
 
+def sample_chain(pool, rng=random):
+    """Sample a chain from a random document.
 
-def sample_neg_event(doc_dir, context_size, stoplist=None):
+    Draws are the same as sampling a document from all documents
+    until it has a chain long enough, then sampling one of its chains.
+    So a seed generates the same questions as without the index.
+    """
+    while True:
+        # Randomly sample a doc, skip docs without chains long enough
+        idx = rng.choice(range(len(pool)))
+        if pool.num_chains[idx] == 0:
+            continue
+        doc = pool.load(idx)
+        # Randomly sample a chain
+        entity, chain = rng.choice(pool.get_chains(doc))
+        return entity, chain, doc
+
+
+def sample_neg_event(pool, rng=random):
     """Sample a negative event from doc."""
-    entity, chain, doc = sample_chain(doc_dir, context_size, stoplist)
-    event = random.choice(chain)
+    entity, chain, doc = sample_chain(pool, rng)
+    event = rng.choice(chain)
     return entity, event
 
 
-def sample_single_question(doc_dir,
-                           context_size=8,
-                           num_distractors=4,
-                           stoplist=None):
-    """Sample a single question from docs."""
-    entity, chain, doc = sample_chain(doc_dir, context_size, stoplist)
-    answer_idx = random.choice(range(context_size, len(chain)))
+def sample_single_question(pool, num_distractors=4, rng=random):
+    """Sample a single question from docs.
+
+    :param rng: random stream, the global random module by default.
+    """
+    context_size = pool.context_size
+    entity, chain, doc = sample_chain(pool, rng)
+    answer_idx = rng.choice(range(context_size, len(chain)))
     answer = chain[answer_idx]
     context = chain[answer_idx-context_size:answer_idx]
     # Generate distractors
     non_protagonist_entities = [e for e in doc.entities if e is not entity]
     distractors = []
     for _ in range(num_distractors):
-        neg_protagonist, neg_event = sample_neg_event(doc_dir, context_size, stoplist)
+        neg_protagonist, neg_event = sample_neg_event(pool, rng)
         event = deepcopy(neg_event)
         protagonist_id = neg_protagonist.ent_id
         # Replace each entity argument with a non-protagonist entity
@@ -61,7 +113,7 @@ def sample_single_question(doc_dir,
                     role.concept = entity.concept
                 elif len(non_protagonist_entities) > 0:
                     # In some cases, there are no other entities
-                    rand_ent = random.choice(non_protagonist_entities)
+                    rand_ent = rng.choice(non_protagonist_entities)
                     role.ent_id = rand_ent.ent_id
                     role.value = rand_ent.head
                     role.concept = rand_ent.concept
@@ -72,7 +124,7 @@ def sample_single_question(doc_dir,
     # Construct question
     entity_id = entity.ent_id
     choices = distractors + [answer]
-    random.shuffle(choices)
+    rng.shuffle(choices)
     target = choices.index(answer)
     json_doc = doc.to_json()
     json_doc["entity_id"] = entity_id
@@ -82,15 +134,89 @@ def sample_single_question(doc_dir,
     return json_doc
 
 
-def sample_questions(doc_dir, question_dir, num_questions=1000, stoplist=None):
-    """Sample questions from docs."""
+def question_rng(seed, qid):
+    """Independent random stream of a question, derived from seed and question id."""
+    return random.Random(f"{seed}-{qid}")
+
+
+# Document pool of each worker, set by _init_worker
+_WORKER_POOL = None
+
+
+def _init_worker(pool):
+    """Initialize question sampling worker."""
+    global _WORKER_POOL
+    _WORKER_POOL = pool
+
+
+def _sample_chunk(seed, qids, question_paths=None):
+    """Sample questions of qids in worker.
+
+    If question_paths is given, save questions to them,
+    else return the questions.
+    """
+    questions = []
+    for idx, qid in enumerate(qids):
+        question = sample_single_question(_WORKER_POOL, rng=question_rng(seed, qid))
+        if question_paths is not None:
+            with open(question_paths[idx], "w") as f:
+                json.dump(question, f)
+        else:
+            questions.append(question)
+    return questions
+
+
+def sample_questions(doc_store, question_dir, num_questions=1000, stoplist=None,
+                     seed=None, jobs=1, jsonl=False, chunk_size=100):
+    """Sample questions from docs.
+
+    :param seed: if None, sample questions one after another
+        from the global random stream. Otherwise, each question has its own
+        random stream derived from seed and question id, and questions are
+        sampled by jobs worker processes. The output does not depend on jobs.
+    :param jsonl: write all questions to "<question_dir>.jsonl", one per line,
+        instead of one file per question in question_dir.
+    """
+    pool = DocumentPool(doc_store, stoplist=stoplist)
     num_zfill = math.ceil(math.log10(num_questions))
-    for qid in range(num_questions):
-        question_path = os.path.join(
-            question_dir, f"question{str(qid).zfill(num_zfill)}.txt")
-        question = sample_single_question(doc_dir, stoplist=stoplist)
-        with open(question_path, "w") as f:
-            json.dump(question, f)
+    question_paths = [
+        os.path.join(question_dir, f"question{str(qid).zfill(num_zfill)}.txt")
+        for qid in range(num_questions)]
+    # The jsonl file is saved next to question_dir, e.g. eval/dev.jsonl
+    os.makedirs(os.path.dirname(os.path.abspath(question_dir)) if jsonl else question_dir,
+                exist_ok=True)
+    with open(f"{question_dir}.jsonl", "w") if jsonl else nullcontext() as jsonl_file:
+        def save(questions, paths):
+            for question, question_path in zip(questions, paths):
+                if jsonl_file is not None:
+                    jsonl_file.write(json.dumps(question) + "\n")
+                else:
+                    with open(question_path, "w") as f:
+                        json.dump(question, f)
+
+        with tqdm(total=num_questions) as pbar:
+            if seed is None:
+                for qid in range(num_questions):
+                    save([sample_single_question(pool)], question_paths[qid:qid+1])
+                    pbar.update(1)
+            elif jobs <= 1:
+                for qid in range(num_questions):
+                    save([sample_single_question(pool, rng=question_rng(seed, qid))],
+                         question_paths[qid:qid+1])
+                    pbar.update(1)
+            else:
+                chunks = batchify(list(range(num_questions)), chunk_size)
+                with ProcessPoolExecutor(max_workers=jobs,
+                                         initializer=_init_worker,
+                                         initargs=(pool,)) as executor:
+                    # Workers write question files, or return questions in order for jsonl
+                    futures = [
+                        executor.submit(_sample_chunk, seed, qids,
+                                        None if jsonl else question_paths[qids[0]:qids[-1]+1])
+                        for qids in chunks]
+                    for qids, future in zip(chunks, futures):
+                        save(future.result(), question_paths[qids[0]:qids[-1]+1])
+                        pbar.update(len(qids))
 
 
 def load_stoplist(word_dir):
@@ -100,26 +226,33 @@ def load_stoplist(word_dir):
     with open(fp, "r") as f:
         for line in f:
             stoplist.append(tuple(line.strip().split("\t")))
-    return stoplist
+    return frozenset(stoplist)
+
 
+def generate_eval_set(work_dir, num_questions=1000, seed=0, storage="file",
+                      per_question_seed=False, jobs=1, jsonl=False):
+    """Generate evaluation datasets.
 
-def generate_eval_set(work_dir, num_questions=1000, seed=0):
-    """Generate evaluation datasets."""
+    :param per_question_seed: derive one random stream per question from seed,
+        so that questions can be sampled by jobs worker processes.
+    :param jsonl: write each set to one jsonl file.
+    """
     stoplist = load_stoplist(work_dir)
+    question_seed = seed if per_question_seed else None
     logging.info("Generating dev set ...")
     random.seed(seed)
-    dev_doc_dir = os.path.join(work_dir, "rich_docs", "dev")
+    dev_doc_store = open_split_store(work_dir, "dev", storage)
     dev_question_dir = os.path.join(work_dir, "eval", "dev")
-    os.makedirs(dev_question_dir, exist_ok=True)
-    sample_questions(dev_doc_dir, dev_question_dir, num_questions, stoplist)
+    sample_questions(dev_doc_store, dev_question_dir, num_questions, stoplist,
+                     seed=question_seed, jobs=jobs, jsonl=jsonl)
     logging.info(f"Dev set generated to {dev_question_dir}, "
                  f"totally {num_questions} questions.")
     logging.info("Generating test set ...")
     random.seed(seed)
-    test_doc_dir = os.path.join(work_dir, "rich_docs", "test")
+    test_doc_store = open_split_store(work_dir, "test", storage)
     test_question_dir = os.path.join(work_dir, "eval", "test")
-    os.makedirs(test_question_dir, exist_ok=True)
-    sample_questions(test_doc_dir, test_question_dir, num_questions, stoplist)
+    sample_questions(test_doc_store, test_question_dir, num_questions, stoplist,
+                     seed=question_seed, jobs=jobs, jsonl=jsonl)
     logging.info(f"Test set generated to {test_question_dir}, "
                  f"totally {num_questions} questions.")
 
@@ -127,4 +260,8 @@ def generate_eval_set(work_dir, num_questions=1000, seed=0):
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
                         level=logging.INFO)
-    generate_eval_set(CONFIG.work_dir, CONFIG.num_questions, seed=CONFIG.seed)
+    generate_eval_set(CONFIG.work_dir, CONFIG.num_questions, seed=CONFIG.seed,
+                      storage=CONFIG.storage,
+                      per_question_seed=CONFIG.per_question_seed,
+                      jobs=CONFIG.jobs,
+                      jsonl=CONFIG.questions_jsonl)
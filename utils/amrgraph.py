@@ -1,22 +1,66 @@
 """Definition of AMR graph class."""
+import functools
 import json
 import re
+import time
 
 import penman
-import spacy
-from amrlib.alignments.rbw_aligner import RBWAligner
 # from amrlib.graph_processing.annotator import add_lemmas
 from penman.models import noop
-from spacy.tokens import Doc
 
 VERB_FRAME_PATTERN = re.compile(r".+-\d+")
 STATIC_FRAMES = ["have-rel-role-91", "have-org-role-91"]
 CONJUNCTION_FRAMES = ["and"]
-# Tokenizer
+# Tokenizer, loaded on first use by get_tokenizer
 _exclude_components = ["parser"]
-TOKENIZER = spacy.load("en_core_web_sm", exclude=_exclude_components)
 # Filter alignments
 ALIGNMENT_FILTER = ["have-rel-role-91", "have-org-role-91"]
+# Aligner statistics, used to check if the aligner is on the hot path
+ALIGN_STATS = {"calls": 0, "seconds": 0.0}
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer():
+    """Load spacy model on first use."""
+    import spacy
+    return spacy.load("en_core_web_sm", exclude=_exclude_components)
+
+
+@functools.lru_cache(maxsize=None)
+def get_aligner():
+    """Import RBWAligner on first use."""
+    from amrlib.alignments.rbw_aligner import RBWAligner
+    return RBWAligner
+
+
+def preload_models():
+    """Load tokenizer and aligner now.
+
+    Call before forking pool workers, so that they share the loaded models.
+    """
+    get_tokenizer()
+    get_aligner()
+
+
+def __getattr__(name):
+    # Keep TOKENIZER importable from this module, loaded on first access
+    if name == "TOKENIZER":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _lemmatize(doc):
+    """Get lemmas from a processed spacy doc."""
+    lemmas = []
+    for t in doc:
+        if t.lemma_ == "-PRON-":
+            lemma = t.text.lower()
+        elif t.tag_.startswith("NNP") or t.ent_type_ not in ("", "O"):
+            lemma = t.text
+        else:
+            lemma = t.lemma_.lower()
+        lemmas.append(lemma)
+    return lemmas
 
 
 def add_lemmas(graph):
@@ -28,28 +72,40 @@ def add_lemmas(graph):
     snt = penman_graph.metadata["snt"]
     penman_graph.metadata["tokens"] = json.dumps(snt.split())
     # Use spacy to get lemmas
-    doc = Doc(TOKENIZER.vocab, words=snt.split())
-    for name, proc in TOKENIZER.pipeline:
+    from spacy.tokens import Doc
+    tokenizer = get_tokenizer()
+    doc = Doc(tokenizer.vocab, words=snt.split())
+    for name, proc in tokenizer.pipeline:
         doc = proc(doc)
-    lemmas = []
-    for t in doc:
-        if t.lemma_ == "-PRON-":
-            lemma = t.text.lower()
-        elif t.tag_.startswith("NNP") or t.ent_type_ not in ("", "O"):
-            lemma = t.text
-        else:
-            lemma = t.lemma_.lower()
-        lemmas.append(lemma)
     # Add lemma
-    penman_graph.metadata["lemmas"] = json.dumps(lemmas)
+    penman_graph.metadata["lemmas"] = json.dumps(_lemmatize(doc))
     return penman_graph
 
 
-def align_graph(graph):
-    """Align single amr graph."""
-    # penman_graph = add_lemmas(graph, snt_key='snt')
-    penman_graph = add_lemmas(graph)
-    align_result = RBWAligner.from_penman_w_json(penman_graph)
+def add_lemmas_batch(graphs, batch_size=256):
+    """Add tokens and lemmas to penman graphs in batch.
+
+    Same as add_lemmas, but runs each pipeline component over all
+    pre-tokenized sentences at once.
+    """
+    penman_graphs = [penman.decode(graph, model=noop.model) for graph in graphs]
+    words = [g.metadata["snt"].split() for g in penman_graphs]
+    # spacy 3.1 does not accept Doc inputs in tokenizer.pipe,
+    # so chain the pipe of each component instead.
+    from spacy.tokens import Doc
+    tokenizer = get_tokenizer()
+    docs = (Doc(tokenizer.vocab, words=w) for w in words)
+    for name, proc in tokenizer.pipeline:
+        docs = proc.pipe(docs, batch_size=batch_size)
+    for penman_graph, w, doc in zip(penman_graphs, words, docs):
+        penman_graph.metadata["tokens"] = json.dumps(w)
+        penman_graph.metadata["lemmas"] = json.dumps(_lemmatize(doc))
+    return penman_graphs
+
+
+def _get_alignments(penman_graph):
+    """Align a lemmatized penman graph with RBWAligner."""
+    align_result = get_aligner().from_penman_w_json(penman_graph)
     ret_val = []
     # Return in one line, "<index0> <short0>\t<index1> <short1>\t..."
     for i, t in enumerate(align_result.alignments):
@@ -60,6 +116,42 @@ def align_graph(graph):
     return ret_val
 
 
+@functools.lru_cache(maxsize=4096)
+def _align_graph(graph):
+    """Align single amr graph, memoized by graph string."""
+    start_time = time.perf_counter()
+    # penman_graph = add_lemmas(graph, snt_key='snt')
+    penman_graph = add_lemmas(graph)
+    ret_val = _get_alignments(penman_graph)
+    ALIGN_STATS["calls"] += 1
+    ALIGN_STATS["seconds"] += time.perf_counter() - start_time
+    return tuple(ret_val)
+
+
+def align_graph(graph):
+    """Align single amr graph."""
+    return list(_align_graph(graph))
+
+
+def align_graphs(graphs, batch_size=256):
+    """Align amr graphs in batch."""
+    start_time = time.perf_counter()
+    penman_graphs = add_lemmas_batch(graphs, batch_size=batch_size)
+    results = [_get_alignments(g) for g in penman_graphs]
+    ALIGN_STATS["calls"] += len(results)
+    ALIGN_STATS["seconds"] += time.perf_counter() - start_time
+    return results
+
+
+def align_stats():
+    """Return aligner statistics: runs, cache hits and time spent."""
+    return {
+        "calls": ALIGN_STATS["calls"],
+        "cache_hits": _align_graph.cache_info().hits,
+        "seconds": ALIGN_STATS["seconds"],
+    }
+
+
 # We define amr node/graph class instead of
 #   directly using penman graph for extensibility.
 class AMRNode:
@@ -76,7 +168,8 @@ class AMRNode:
         value = value or ""
         self.value = value
         self.relations = relations or {}
-        self.scope = [False] * (token_num or 0)
+        # Scope as a bitmask, bit i is set if token i is covered
+        self.scope_bits = 0
         self.pos = None
         # Unaccessible
         self._token_num = token_num
@@ -107,34 +200,38 @@ class AMRNode:
                 children.append(t)
         return children
 
+    @property
+    def scope(self):
+        """Scope as a list, item i is True if token i is covered."""
+        bits = self.scope_bits
+        return [bool(bits >> i & 1) for i in range(self._token_num or 0)]
+
     @property
     def head_idx(self):
         """Return head word index."""
-        for i in range(len(self.scope))[::-1]:
-            if self.scope[i]:
-                return i
-        return None
+        # The rightmost covered token
+        if self.scope_bits == 0:
+            return None
+        return self.scope_bits.bit_length() - 1
 
     @property
     def span(self):
         """Return rightmost continuous scope."""
-        start, end = None, None
         # Continuity is a really strong constraint. Try discrete tolerant = 1 .
         # This may be problematic for verbs, but usually work for entities.
-        skip = 0
-        tolerant = 1
-        for i in range(len(self.scope))[::-1]:
-            if end is None and self.scope[i]:
-                end = i + 1
-            if end is not None:
-                if self.scope[i]:
-                    skip = 0
-                    start = i
-                elif skip < tolerant:
-                    skip += 1
-                else:
-                    break
-        return start, end
+        # That is, the span ends at the rightmost covered token,
+        #   and stops at the first two adjacent uncovered tokens on the left.
+        bits = self.scope_bits
+        if bits == 0:
+            return None, None
+        head = bits.bit_length() - 1
+        # Bit i is set if both token i and token i+1 are uncovered
+        gaps = ~(bits | (bits >> 1)) & ((1 << head) - 1)
+        if gaps:
+            bits &= -1 << gaps.bit_length()
+        # The leftmost covered token in the span
+        start = (bits & -bits).bit_length() - 1
+        return start, head + 1
 
     @property
     def visit(self):
@@ -158,8 +255,12 @@ class AMRNode:
     def update_pos(self, align_idx):
         """Update node position with aligned token index."""
         self.pos = align_idx
-        if len(self.scope) >= align_idx:
-            self.scope[align_idx] = True
+        token_num = self._token_num or 0
+        if token_num >= align_idx:
+            # Same as setting an item of a list with token_num items
+            if not -token_num <= align_idx < token_num:
+                raise IndexError("scope index out of range")
+            self.scope_bits |= 1 << (align_idx % token_num)
 
     def update_scope_from_children(self):
         """Update scope from child nodes."""
@@ -172,8 +273,7 @@ class AMRNode:
         # Second, update scope to cover each child
         for child in self.children:
             if isinstance(child, AMRNode):
-                for i in range(len(self.scope)):
-                    self.scope[i] = self.scope[i] or child.scope[i]
+                self.scope_bits |= child.scope_bits
 
 
 class AMRGraph:
@@ -232,7 +332,7 @@ class AMRGraph:
         g = penman.decode(text, model=noop.model)
         # Get tokens
         if tokens is None and "snt" in g.metadata:
-            tokens = [_.text for _ in TOKENIZER(g.metadata["snt"])]
+            tokens = [_.text for _ in get_tokenizer()(g.metadata["snt"])]
         else:
             pass
         if tokens is not None:
@@ -258,12 +358,9 @@ class AMRGraph:
         # Construct graph
         root = id2node[g.top]
         graph = cls(root=root, nodes=nodes, id2node=id2node, tokens=tokens)
-        align_graph(text)
-        # Compute scope
+        # Compute scope, only align the graph if no alignments are given
         if alignments is None:
             alignments = align_graph(text)
-        else:
-            pass
         for idx, id_ in alignments:
             node = graph.find_node_by_id(id_)
             if node.value not in ALIGNMENT_FILTER:
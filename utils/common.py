@@ -1,19 +1,469 @@
 """Commonly used functions."""
+import json
+import logging
+import multiprocessing
 import os
+import queue
+import socket
+import threading
+import time
+from collections import Counter
 
 
-def map_input_output(in_dir, out_dir):
-    """Map input paths to output paths."""
-    in_paths, out_paths = [], []
-    for subdir in os.listdir(in_dir):
-        in_subdir = os.path.join(in_dir, subdir)
-        out_subdir = os.path.join(out_dir, subdir)
-        if not os.path.exists(out_subdir):
-            os.makedirs(out_subdir)
-        for fn in os.listdir(in_subdir):
-            in_paths.append(os.path.join(in_subdir, fn))
-            out_paths.append(os.path.join(out_subdir, fn))
-    return in_paths, out_paths
+class FileStore:
+    """Document store with one file per document (the default layout).
+
+    A key is the relative path of a document, e.g. "<subdir>/<doc_name>".
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._dirs = set()
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+
+    def __reduce__(self):
+        return open_store, (self.base_dir, "file")
+
+    def path(self, key):
+        """Return file path of a document."""
+        return os.path.join(self.base_dir, key)
+
+    def keys(self):
+        """Return keys of all documents."""
+        keys = []
+        for root, dirs, files in os.walk(self.base_dir):
+            rel_root = os.path.relpath(root, self.base_dir)
+            for fn in files:
+                keys.append(fn if rel_root == "." else os.path.join(rel_root, fn))
+        return keys
+
+    def exists(self, key):
+        """If the document exists."""
+        return os.path.exists(self.path(key))
+
+    def read(self, key):
+        """Read document content."""
+        with open(self.path(key), "r") as f:
+            return f.read()
+
+    def write(self, key, content):
+        """Write document content."""
+        path = self.path(key)
+        dir_name = os.path.dirname(path)
+        if dir_name not in self._dirs:
+            os.makedirs(dir_name, exist_ok=True)
+            self._dirs.add(dir_name)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def _parse_index_line(line, shard_size):
+    """Parse a shard index line to (key, offset, length, seq).
+
+    :return: None if the line or its record is not completely written.
+    """
+    if not line.endswith("\n"):
+        return None
+    fields = line[:-1].split("\t")
+    if len(fields) not in (3, 4):
+        return None
+    try:
+        offset, length = int(fields[1]), int(fields[2])
+        # Lines without seq, written by older versions, come first
+        seq = int(fields[3]) if len(fields) == 4 else -1
+    except ValueError:
+        return None
+    if offset < 0 or length <= 0 or offset + length > shard_size:
+        return None
+    return fields[0], offset, length, seq
+
+
+class ShardStore:
+    """Document store packed in append-only jsonl shards.
+
+    Each process appends {"key": ..., "content": ...} lines to its own
+    shard "part-<host>-<pid>.jsonl", and "<key>\\t<offset>\\t<length>\\t<seq>"
+    lines to the doc-id offset index "part-<host>-<pid>.idx",
+    seq is the write time in nanoseconds, increasing in each process.
+    If a key is written more than once, the record with the largest seq is used
+    (index lines of older versions have no seq and lose to those with one).
+    Incomplete index lines, e.g. left by a crash, are skipped.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._index = None
+        self._readers = {}
+        self._writer = None
+        self._writer_pid = None
+        self._seq = 0
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir, exist_ok=True)
+
+    def __reduce__(self):
+        return open_store, (self.base_dir, "shard")
+
+    @property
+    def index(self):
+        """Key -> (shard name, offset, length) index, loaded on first use."""
+        if self._index is None:
+            records = {}
+            for fn in sorted(os.listdir(self.base_dir)):
+                if not fn.endswith(".idx"):
+                    continue
+                shard = fn[:-len(".idx")] + ".jsonl"
+                shard_path = os.path.join(self.base_dir, shard)
+                shard_size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+                with open(os.path.join(self.base_dir, fn), "r") as f:
+                    for line in f:
+                        record = _parse_index_line(line, shard_size)
+                        if record is None:
+                            logging.warning(f"Skip incomplete index line in {fn}: {line!r}")
+                            continue
+                        key, offset, length, seq = record
+                        if key not in records or seq >= records[key][0]:
+                            records[key] = (seq, shard, offset, length)
+            self._index = {key: (shard, offset, length)
+                           for key, (seq, shard, offset, length) in records.items()}
+        return self._index
+
+    def keys(self):
+        """Return keys of all documents."""
+        return list(self.index.keys())
+
+    def exists(self, key):
+        """If the document exists."""
+        return key in self.index
+
+    def read(self, key):
+        """Read document content."""
+        shard, offset, length = self.index[key]
+        if shard not in self._readers:
+            self._readers[shard] = os.open(os.path.join(self.base_dir, shard), os.O_RDONLY)
+        # Positional read, safe to share the descriptor with forked processes
+        record = os.pread(self._readers[shard], length, offset)
+        return json.loads(record)["content"]
+
+    def write(self, key, content):
+        """Append document content to the shard of this process."""
+        if self._writer_pid != os.getpid():
+            name = f"part-{socket.gethostname()}-{os.getpid()}"
+            self._writer = (open(os.path.join(self.base_dir, f"{name}.jsonl"), "ab"),
+                            open(os.path.join(self.base_dir, f"{name}.idx"), "a+"))
+            self._writer_pid = os.getpid()
+            # End an incomplete last line of a crashed process with the same pid
+            index_file = self._writer[1]
+            if index_file.tell() > 0:
+                index_file.seek(index_file.tell() - 1)
+                if index_file.read(1) != "\n":
+                    index_file.write("\n")
+        shard_file, index_file = self._writer
+        record = (json.dumps({"key": key, "content": content}) + "\n").encode("utf-8")
+        offset = shard_file.tell()
+        shard_file.write(record)
+        shard_file.flush()
+        self._seq = max(self._seq + 1, time.time_ns())
+        # Only index records that are completely written
+        index_file.write(f"{key}\t{offset}\t{len(record)}\t{self._seq}\n")
+        index_file.flush()
+        self.index[key] = (os.path.basename(shard_file.name), offset, len(record))
+
+
+class SplitStore:
+    """Read-only view of some documents in another store.
+
+    Keys are document file names, the same as in rich_docs/<split>,
+    and are mapped to the keys in the underlying store.
+    """
+
+    def __init__(self, store, keys):
+        self.store = store
+        self._keys = {os.path.basename(key): key for key in keys}
+
+    def path(self, key):
+        """Return file path of a document, only for file stores."""
+        return self.store.path(self._keys[key])
+
+    def keys(self):
+        """Return keys of all documents."""
+        return list(self._keys)
+
+    def exists(self, key):
+        """If the document exists."""
+        return key in self._keys
+
+    def read(self, key):
+        """Read document content."""
+        return self.store.read(self._keys[key])
+
+
+# Stores opened by this process
+_STORES = {}
+
+
+def open_store(base_dir, storage="file"):
+    """Open document store under base_dir, storage is "file" or "shard".
+
+    Stores are cached per process, so that a shard index is loaded once.
+    """
+    store_key = (os.path.abspath(base_dir), storage)
+    if store_key not in _STORES:
+        if storage == "file":
+            _STORES[store_key] = FileStore(base_dir)
+        elif storage == "shard":
+            _STORES[store_key] = ShardStore(base_dir)
+        else:
+            raise ValueError(f"Unknown storage: {storage}")
+    return _STORES[store_key]
+
+
+def open_split_store(work_dir, split, storage="file"):
+    """Open documents of a data split ("train", "dev" or "test").
+
+    If step 7 wrote the split list rich_docs/<split>.list,
+    return a view of the listed documents in event/,
+    otherwise open the split directory rich_docs/<split>.
+    """
+    list_path = os.path.join(work_dir, "rich_docs", f"{split}.list")
+    if os.path.exists(list_path):
+        with open(list_path, "r") as f:
+            keys = f.read().splitlines()
+        return SplitStore(open_store(os.path.join(work_dir, "event"), storage), keys)
+    return open_store(os.path.join(work_dir, "rich_docs", split), storage)
+
+
+def pending_keys(in_store, out_store, workers=1, worker_id=0,
+                 manifest=None, in_stage=None, out_stage=None):
+    """Return keys of this worker in in_store that are not in out_store.
+
+    If manifest is given, documents are looked up in the manifest
+    (in_stage done and out_stage not done) instead of the stores.
+    """
+    if manifest is not None:
+        manifest.sync(in_stage, in_store)
+        manifest.sync(out_stage, out_store)
+        done = set(manifest.keys(out_stage))
+        in_keys = manifest.keys(in_stage)
+        is_done = done.__contains__
+    else:
+        in_keys = in_store.keys()
+        is_done = out_store.exists
+    keys = []
+    for idx, key in enumerate(in_keys):
+        if (idx % workers) == worker_id and not is_done(key):
+            keys.append(key)
+    return keys
+
+
+def batchify(items, batch_size):
+    """Split items into batches."""
+    return [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+
+
+def token_budget_groups(lengths, max_tokens):
+    """Group items of similar length into batches under a token budget.
+
+    Items are sorted by length, and the padded size of a batch
+    (number of items * longest item) never exceeds max_tokens.
+    An item longer than max_tokens forms a batch by itself.
+
+    :param lengths: number of tokens of each item.
+    :return: list of batches, each is a list of item indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch, batch_max = [], 0
+    for i in order:
+        new_max = max(batch_max, lengths[i])
+        if len(batch) > 0 and new_max * (len(batch) + 1) > max_tokens:
+            batches.append(batch)
+            batch, new_max = [], lengths[i]
+        batch.append(i)
+        batch_max = new_max
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def parse_devices(devices, default=0):
+    """Parse comma separated device list, -1 means cpu."""
+    if not devices:
+        return [default]
+    return [int(d) for d in devices.split(",")]
+
+
+# Local worker state, set by _init_local_worker
+_LOCAL_DEVICE = None
+
+
+def _init_local_worker(device_queue, initializer, initargs):
+    """Take a device and initialize local worker."""
+    global _LOCAL_DEVICE
+    _LOCAL_DEVICE = device_queue.get()
+    if initializer is not None:
+        initializer(_LOCAL_DEVICE, *initargs)
+
+
+def _run_local_task(args):
+    """Run a task in local worker."""
+    func, task = args
+    return (os.getpid(), _LOCAL_DEVICE) + tuple(func(*task))
+
+
+def run_tasks(func, tasks, jobs=1, devices=None, initializer=None, initargs=(),
+              pbar=None, on_result=None):
+    """Run tasks in this process, or with local worker processes.
+
+    If jobs > 1, spawn jobs local worker processes sharing one work queue.
+    Worker k takes device devices[k % len(devices)] and calls
+    initializer(device, *initargs) once, e.g. to load a model.
+    Then workers pull tasks one by one, so slow tasks do not leave other
+    workers idle.
+
+    Each task is an argument tuple, func(*task) must return
+    (succeeded keys, failed (key, reason) pairs),
+    optionally followed by a dict of seconds spent in each phase.
+    on_result(succeeded, failed) is called in this process after each task.
+
+    :return: report dict, pid -> [device, success_num, failed pairs, phase seconds]
+    """
+    devices = devices or [0]
+    report = {}
+
+    def collect(pid, device, succeeded, failed, timing=None):
+        worker = report.setdefault(pid, [device, 0, [], Counter()])
+        worker[1] += len(succeeded)
+        worker[2].extend(failed)
+        worker[3].update(timing or {})
+        if on_result is not None:
+            on_result(succeeded, failed)
+        if pbar is not None:
+            pbar.update(len(succeeded) + len(failed))
+
+    if jobs <= 1:
+        if initializer is not None:
+            initializer(devices[0], *initargs)
+        for task in tasks:
+            collect(os.getpid(), devices[0], *func(*task))
+        return report
+    ctx = multiprocessing.get_context("spawn")
+    device_queue = ctx.Queue()
+    for k in range(jobs):
+        device_queue.put(devices[k % len(devices)])
+    with ctx.Pool(processes=jobs,
+                  initializer=_init_local_worker,
+                  initargs=(device_queue, initializer, initargs)) as pool:
+        for result in pool.imap_unordered(_run_local_task, [(func, task) for task in tasks]):
+            collect(*result)
+    return report
+
+
+def log_worker_report(report, logger=None):
+    """Log success/failure counts and phase time of each worker and in total."""
+    logger = logger or logging.getLogger(__name__)
+    tot_success, tot_failed = 0, []
+    for pid, (device, success_num, failed, timing) in sorted(report.items()):
+        logger.info(f"Worker {pid} (device {device}): "
+                    f"{success_num} docs succeeded, {len(failed)} failed.")
+        if len(timing) > 0:
+            logger.info(f"Worker {pid} time: "
+                        + ", ".join([f"{phase} {seconds:.2f}s" for phase, seconds in timing.items()]))
+        tot_success += success_num
+        tot_failed.extend(failed)
+    logger.info(f"Totally {tot_success} docs succeeded, {len(tot_failed)} failed.")
+    logger.info("\n" + "\n".join([f"{key}\t{reason}" for key, reason in tot_failed]))
+
+
+# End of stream marker of run_pipelined
+_DONE = object()
+
+
+def run_pipelined(items, read, infer, write, queue_size=2, timing=None):
+    """Run read -> infer -> write over items, overlapping I/O with inference.
+
+    A reader thread prefetches up to queue_size items ahead of infer,
+    infer runs in this thread, and a writer thread writes results
+    in item order, at most queue_size results behind infer.
+
+    :param read: read(item) -> data.
+    :param infer: infer(item, data) -> result.
+    :param write: write(item, data, result) -> value, yielded in item order
+        once written.
+    :param timing: Counter updated with seconds of "read", "infer" and "write".
+    """
+    timing = timing if timing is not None else Counter()
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    done_queue = queue.Queue()
+
+    def timed(phase, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            timing[phase] += time.perf_counter() - start
+
+    def reader():
+        try:
+            for item in items:
+                read_queue.put((item, timed("read", read, item), None))
+        except Exception as e:
+            read_queue.put((None, None, e))
+        read_queue.put(_DONE)
+
+    def writer():
+        while True:
+            job = write_queue.get()
+            if job is _DONE:
+                break
+            try:
+                done_queue.put((timed("write", write, *job), None))
+            except Exception as e:
+                done_queue.put((None, e))
+                # Drain, so that infer is not blocked
+                while write_queue.get() is not _DONE:
+                    pass
+                break
+        done_queue.put(_DONE)
+
+    threads = [threading.Thread(target=reader, daemon=True),
+               threading.Thread(target=writer, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    def results(block):
+        while True:
+            try:
+                done = done_queue.get(block=block)
+            except queue.Empty:
+                return
+            if done is _DONE:
+                return
+            value, error = done
+            if error is not None:
+                raise error
+            yield value
+
+    error = None
+    while True:
+        job = read_queue.get()
+        if job is _DONE:
+            break
+        item, data, error = job
+        if error is not None:
+            break
+        try:
+            result = timed("infer", infer, item, data)
+        except Exception as e:
+            error = e
+            break
+        write_queue.put((item, data, result))
+        yield from results(block=False)
+    write_queue.put(_DONE)
+    yield from results(block=True)
+    if error is not None:
+        raise error
 
 
 def normalize_frame(frame):
@@ -1,4 +1,5 @@
 """Convert amr graph to event structure."""
+import functools
 import re
 
 
@@ -6,7 +7,7 @@ import re
 from utils.common import normalize_frame
 from utils.event import Event
 
-RESERVED_RELATIONS = {
+RESERVED_RELATIONS = frozenset({
     ":ARG0", ":ARG1", ":ARG2", ":ARG3", ":ARG4",    # core roles
     # ":name",    # filter name
     ":op1", ":op2", ":op3", ":op4",     # operators
@@ -15,7 +16,8 @@ RESERVED_RELATIONS = {
     ":mod", ":poss", ":polarity",    # modifiers
     # ":year", ":time", ":duration", ":decade", ":weekday",     # filter temporal
     # ":prep-",     # filter preposition
-}
+})
+ARGN_OF = re.compile(r":ARG\d+-of")
 
 
 # Rules
@@ -44,9 +46,8 @@ def add_reverse_of_argn_of(graph):
 
     Caution!!! After this step, there exist cycles in amr graph.
     """
-    p = re.compile(r":ARG\d+-of")
     for h, r, t in graph.relations:
-        if p.match(r) and not isinstance(t, str):
+        if ARGN_OF.match(r) and not isinstance(t, str):
             new_r = r.replace("-of", "")
             t.add_relation(new_r, h)
             # h.remove_relation(r, t)
@@ -66,14 +67,71 @@ def recognize_modalities(graph):
             h.remove_relation(r, t)
 
 
+@functools.lru_cache(maxsize=None)
+def reverse_role(r):
+    """Return ARGN for ARGN-of, otherwise None."""
+    return r.replace("-of", "") if ARGN_OF.match(r) else None
+
+
+# Removed edge in relation lists
+_REMOVED = object()
+
+
+def rewrite_graph(graph):
+    """Apply the rules above in one traversal over nodes.
+
+    Gives the same relations as split_and_node, recognize_modalities,
+    add_reverse_of_argn_of and filter_relations in turn.
+    Removed edges are marked in place and dropped once at the end,
+    reverse edges of ARGN-of are added after the traversal,
+    so that they are never split or removed.
+    """
+    reverse_edges = []
+    for h in graph.nodes:
+        h_is_verb = h.type == "verb"
+        for r, tails in h.relations.items():
+            new_r = reverse_role(r)
+            # Edges added by splitting are not split again
+            num = len(tails)
+            i = 0
+            while i < len(tails):
+                t = tails[i]
+                if t is _REMOVED or isinstance(t, str):
+                    pass
+                elif i < num and t.value == "and":
+                    tails.extend([new_t for new_t in t.children if new_t is not _REMOVED])
+                    tails[i] = _REMOVED
+                elif h_is_verb and t.type == "verb":
+                    # Remove modality relations
+                    tails[i] = _REMOVED
+                elif new_r is not None:
+                    reverse_edges.append((t, new_r, h))
+                i += 1
+    for t, new_r, h in reverse_edges:
+        t.add_relation(new_r, h)
+    # Filter relations
+    for v in graph.nodes:
+        v.relations = {
+            r: [t for t in tails if t is not _REMOVED]
+            for r, tails in v.relations.items() if r in RESERVED_RELATIONS
+        }
+
+
 # Main
-def convert_amr_to_events(graph):
-    """Convert amr graph to event structure."""
+def convert_amr_to_events(graph, single_pass=True):
+    """Convert amr graph to event structure.
+
+    :param single_pass: rewrite graph with rewrite_graph,
+        otherwise apply each rule to the whole graph in turn.
+    """
     # Convert graph
-    split_and_node(graph)
-    recognize_modalities(graph)
-    add_reverse_of_argn_of(graph)
-    filter_relations(graph)
+    if single_pass:
+        rewrite_graph(graph)
+    else:
+        split_and_node(graph)
+        recognize_modalities(graph)
+        add_reverse_of_argn_of(graph)
+        filter_relations(graph)
     # # Export events
     events = []
     for e in graph.get_event_nodes():
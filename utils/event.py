@@ -1,6 +1,8 @@
 
 class Role:
     """Role class."""
+    __slots__ = ("role", "value", "concept", "span", "head_pos", "ent_id")
+
     def __init__(self,
                  role,
                  value,
@@ -40,6 +42,8 @@ class Role:
 
 class Event:
     """Event class."""
+    __slots__ = ("pb_frame", "verb_pos", "sent_id", "roles")
+
     def __init__(self,
                  pb_frame,
                  verb_pos=None,
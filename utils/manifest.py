@@ -0,0 +1,92 @@
+"""Pipeline manifest: per-document status of each stage."""
+import os
+import sqlite3
+import time
+
+
+class Manifest:
+    """Manifest database recording per-document per-stage status.
+
+    Steps query the manifest for pending documents instead of checking
+    the existence of each output file. Each record holds the stage name,
+    document key, status ("done" or "failed"), update time and failure reason.
+
+    Only the main process of a step writes the database. SQLite locking is
+    unreliable on network file systems, so do not share a manifest between
+    --workers processes on different hosts.
+    """
+
+    def __init__(self, db_path, timeout=600):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=timeout)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS status ("
+            "stage TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "updated REAL NOT NULL, "
+            "reason TEXT, "
+            "PRIMARY KEY (stage, key))")
+        self._conn.commit()
+
+    @classmethod
+    def from_work_dir(cls, work_dir):
+        """Open the manifest of a work directory."""
+        return cls(os.path.join(work_dir, "manifest.sqlite"))
+
+    def __reduce__(self):
+        return self.__class__, (self.db_path,)
+
+    def mark(self, stage, keys, status="done", reason=None):
+        """Set status of documents in a stage."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?)",
+                [(stage, key, status, now, reason) for key in keys])
+
+    def mark_failed(self, stage, failures):
+        """Mark documents as failed, failures is a list of (key, reason)."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO status VALUES (?, ?, 'failed', ?, ?)",
+                [(stage, key, now, reason) for key, reason in failures])
+
+    def recorder(self, stage):
+        """Return a callback recording (succeeded keys, failed pairs) of a stage."""
+        def record(succeeded, failed):
+            self.mark(stage, succeeded)
+            self.mark_failed(stage, failed)
+        return record
+
+    def keys(self, stage, status="done"):
+        """Return keys of documents in a stage with status, in sorted order."""
+        cursor = self._conn.execute(
+            "SELECT key FROM status WHERE stage = ? AND status = ? ORDER BY key",
+            (stage, status))
+        return [row[0] for row in cursor]
+
+    def failures(self, stage):
+        """Return (key, reason, updated) of failed documents in a stage."""
+        cursor = self._conn.execute(
+            "SELECT key, reason, updated FROM status "
+            "WHERE stage = ? AND status = 'failed' ORDER BY key",
+            (stage,))
+        return cursor.fetchall()
+
+    def has_stage(self, stage):
+        """If any document of a stage is recorded."""
+        cursor = self._conn.execute(
+            "SELECT 1 FROM status WHERE stage = ? LIMIT 1", (stage,))
+        return cursor.fetchone() is not None
+
+    def sync(self, stage, store):
+        """Record documents already in store, if the stage is not recorded yet.
+
+        This lets the manifest take over a work directory
+        produced without it, at the cost of one listing per stage.
+        """
+        if not self.has_stage(stage):
+            self.mark(stage, store.keys())
@@ -0,0 +1,262 @@
+"""Columnar event store.
+
+Documents are stored column by column in numpy arrays, so that they can be
+memory mapped and read without json parsing. Layout of a store directory:
+
+    vocab.json      interned strings: frames, roles, concepts and words
+    keys.json       document keys and doc_ids, in document order
+    <column>.npy    one array for each column in COLUMNS
+
+String columns hold vocab ids, "*_offsets" columns hold start positions of
+each item in the next level, with one extra end position.
+None is stored as -1 in id and integer columns.
+"""
+import json
+import os
+from array import array
+
+import numpy as np
+
+from utils.narrative.document import Document
+from utils.narrative.entity import Entity
+from utils.narrative.event import Event, Role
+
+# role_value column: VALUE_LIST for token lists, VALUE_NONE for None,
+# otherwise the vocab id of a string value
+VALUE_LIST = -1
+VALUE_NONE = -2
+
+# Column name -> (array typecode, numpy dtype)
+COLUMNS = {
+    # Document level
+    "doc_entity_offsets": ("q", np.int64),
+    "doc_event_offsets": ("q", np.int64),
+    # Entity level
+    "entity_id": ("i", np.int32),
+    "entity_head": ("i", np.int32),
+    "entity_concept": ("i", np.int32),
+    "entity_mention_offsets": ("q", np.int64),
+    "entity_salient_offsets": ("q", np.int64),
+    "mention_word_offsets": ("q", np.int64),
+    "mention_words": ("i", np.int32),
+    "salient_words": ("i", np.int32),
+    # Event level
+    "event_frame": ("i", np.int32),
+    "event_verb_pos": ("i", np.int32),
+    "event_sent_id": ("i", np.int32),
+    "event_role_offsets": ("q", np.int64),
+    # Role level
+    "role_type": ("i", np.int32),
+    "role_concept": ("i", np.int32),
+    "role_ent_id": ("i", np.int32),
+    "role_value": ("i", np.int32),
+    "role_value_offsets": ("q", np.int64),
+    "value_words": ("i", np.int32),
+}
+OFFSET_COLUMNS = [name for name in COLUMNS if name.endswith("_offsets")]
+
+
+def _none_to(value, default=-1):
+    return default if value is None else value
+
+
+def _to_none(value):
+    return None if value == -1 else value
+
+
+class ColumnarWriter:
+    """Build a columnar store, documents are added in order."""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.vocab = {}
+        self.keys = []
+        self.columns = {name: array(typecode) for name, (typecode, dtype) in COLUMNS.items()}
+        for name in OFFSET_COLUMNS:
+            self.columns[name].append(0)
+
+    def intern(self, word):
+        """Return vocab id of a string, -1 for None."""
+        if word is None:
+            return -1
+        if word not in self.vocab:
+            self.vocab[word] = len(self.vocab)
+        return self.vocab[word]
+
+    def _extend_words(self, column, offsets, words):
+        self.columns[column].extend([self.intern(w) for w in words])
+        self.columns[offsets].append(len(self.columns[column]))
+
+    def add(self, key, doc):
+        """Add a document.
+
+        :param key: document key.
+        :param doc: Document object.
+        """
+        cols = self.columns
+        self.keys.append((key, doc.doc_id))
+        for entity in doc.entities:
+            cols["entity_id"].append(entity.ent_id)
+            cols["entity_head"].append(self.intern(entity.head))
+            cols["entity_concept"].append(self.intern(entity.concept))
+            for mention in entity.mentions:
+                self._extend_words("mention_words", "mention_word_offsets", mention)
+            cols["entity_mention_offsets"].append(len(cols["mention_word_offsets"]) - 1)
+            self._extend_words("salient_words", "entity_salient_offsets", entity.salient_mention)
+        cols["doc_entity_offsets"].append(len(cols["entity_id"]))
+        for event in doc.events:
+            cols["event_frame"].append(self.intern(event.pb_frame))
+            cols["event_verb_pos"].append(_none_to(event.verb_pos))
+            cols["event_sent_id"].append(_none_to(event.sent_id))
+            for role in event.roles:
+                cols["role_type"].append(self.intern(role.role))
+                cols["role_concept"].append(self.intern(role.concept))
+                cols["role_ent_id"].append(_none_to(role.ent_id))
+                if role.value is None:
+                    cols["role_value"].append(VALUE_NONE)
+                    self._extend_words("value_words", "role_value_offsets", [])
+                elif isinstance(role.value, str):
+                    cols["role_value"].append(self.intern(role.value))
+                    self._extend_words("value_words", "role_value_offsets", [])
+                else:
+                    cols["role_value"].append(VALUE_LIST)
+                    self._extend_words("value_words", "role_value_offsets", role.value)
+            cols["event_role_offsets"].append(len(cols["role_type"]))
+        cols["doc_event_offsets"].append(len(cols["event_frame"]))
+
+    def close(self):
+        """Write vocab, keys and columns to base_dir."""
+        os.makedirs(self.base_dir, exist_ok=True)
+        with open(os.path.join(self.base_dir, "vocab.json"), "w") as f:
+            json.dump(list(self.vocab), f)
+        with open(os.path.join(self.base_dir, "keys.json"), "w") as f:
+            json.dump(self.keys, f)
+        for name, (typecode, dtype) in COLUMNS.items():
+            np.save(os.path.join(self.base_dir, f"{name}.npy"),
+                    np.frombuffer(self.columns[name], dtype=dtype)
+                    if len(self.columns[name]) else np.zeros(0, dtype=dtype))
+
+
+class ColumnarStore:
+    """Read-only document store over a columnar store directory.
+
+    Provides keys/exists/read like other document stores, and document(key)
+    to build a Document directly from the columns.
+    """
+
+    def __init__(self, base_dir, mmap=True):
+        self.base_dir = base_dir
+        self.mmap = mmap
+        with open(os.path.join(base_dir, "vocab.json"), "r") as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(base_dir, "keys.json"), "r") as f:
+            self._keys = [tuple(item) for item in json.load(f)]
+        self._key_index = {key: idx for idx, (key, doc_id) in enumerate(self._keys)}
+        self.columns = {
+            name: np.load(os.path.join(base_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in COLUMNS
+        }
+
+    def __reduce__(self):
+        return ColumnarStore, (self.base_dir, self.mmap)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        """Return keys of all documents."""
+        return [key for key, doc_id in self._keys]
+
+    def exists(self, key):
+        """If the document exists."""
+        return key in self._key_index
+
+    def read(self, key):
+        """Read document content as json string."""
+        return json.dumps(self.document(key).to_json())
+
+    def _words(self, column, offsets, start, end):
+        """Split words column[offsets[start]:offsets[end]] by offsets."""
+        offsets = self.columns[offsets][start:end + 1].tolist()
+        words = self.columns[column][offsets[0]:offsets[-1]].tolist()
+        base = offsets[0]
+        vocab = self.vocab
+        return [[vocab[w] for w in words[s - base:e - base]]
+                for s, e in zip(offsets[:-1], offsets[1:])]
+
+    def _entities(self, start, end):
+        cols, vocab = self.columns, self.vocab
+        mention_offsets = cols["entity_mention_offsets"][start:end + 1].tolist()
+        mentions = self._words("mention_words", "mention_word_offsets",
+                               mention_offsets[0], mention_offsets[-1])
+        salient_mentions = self._words("salient_words", "entity_salient_offsets", start, end)
+        base = mention_offsets[0]
+        entities = []
+        for i, (ent_id, head, concept) in enumerate(zip(cols["entity_id"][start:end].tolist(),
+                                                        cols["entity_head"][start:end].tolist(),
+                                                        cols["entity_concept"][start:end].tolist())):
+            entities.append(Entity(
+                mentions=mentions[mention_offsets[i] - base:mention_offsets[i + 1] - base],
+                ent_id=ent_id,
+                head=vocab[head],
+                salient_mention=salient_mentions[i],
+                concept=vocab[concept] if concept >= 0 else None))
+        return entities
+
+    def _events(self, start, end):
+        cols, vocab = self.columns, self.vocab
+        role_offsets = cols["event_role_offsets"][start:end + 1].tolist()
+        r_start, r_end = role_offsets[0], role_offsets[-1]
+        values = self._words("value_words", "role_value_offsets", r_start, r_end)
+        roles = []
+        for i, (role, concept, ent_id, value) in enumerate(zip(cols["role_type"][r_start:r_end].tolist(),
+                                                               cols["role_concept"][r_start:r_end].tolist(),
+                                                               cols["role_ent_id"][r_start:r_end].tolist(),
+                                                               cols["role_value"][r_start:r_end].tolist())):
+            if value == VALUE_LIST:
+                value = values[i]
+            elif value == VALUE_NONE:
+                value = None
+            else:
+                value = vocab[value]
+            roles.append(Role(role=vocab[role],
+                              value=value,
+                              concept=vocab[concept] if concept >= 0 else None,
+                              ent_id=_to_none(ent_id)))
+        events = []
+        for i, (frame, verb_pos, sent_id) in enumerate(zip(cols["event_frame"][start:end].tolist(),
+                                                           cols["event_verb_pos"][start:end].tolist(),
+                                                           cols["event_sent_id"][start:end].tolist())):
+            event = Event(pb_frame=vocab[frame],
+                          verb_pos=_to_none(verb_pos),
+                          sent_id=_to_none(sent_id),
+                          roles=[])
+            event.roles = roles[role_offsets[i] - r_start:role_offsets[i + 1] - r_start]
+            events.append(event)
+        return events
+
+    def document(self, key):
+        """Build a Document from the columns."""
+        idx = self._key_index[key]
+        cols = self.columns
+        ent_start, ent_end = cols["doc_entity_offsets"][idx:idx + 2].tolist()
+        ev_start, ev_end = cols["doc_event_offsets"][idx:idx + 2].tolist()
+        return Document(self._keys[idx][1],
+                        self._entities(ent_start, ent_end),
+                        self._events(ev_start, ev_end))
+
+
+def convert_store(in_store, out_dir, pbar=None):
+    """Convert a json document store to a columnar store.
+
+    :param in_store: document store, see utils.common.open_store.
+    :param out_dir: directory of the columnar store.
+    :return: number of converted documents.
+    """
+    writer = ColumnarWriter(out_dir)
+    for key in sorted(in_store.keys()):
+        writer.add(key, Document.from_store(in_store, key))
+        if pbar is not None:
+            pbar.update()
+    writer.close()
+    return len(writer.keys)
@@ -20,6 +20,7 @@ class Document:
         self.doc_id = doc_id
         self.entities = entities
         self.events = events
+        self._chain_index = None
 
     @classmethod
     def from_file(cls, fpath, tokens=None):
@@ -30,6 +31,15 @@ class Document:
         """
         with open(fpath, "r") as f:
             doc = json.load(f)
+        return cls.from_json(doc, tokens)
+
+    @classmethod
+    def from_json(cls, doc, tokens=None):
+        """Read document from json object.
+
+        :param doc: json object.
+        :param tokens: tokens of the original text.
+        """
         tokens = tokens or []
         doc.setdefault("tokens", tokens)
         doc_id = doc["doc_id"]
@@ -37,6 +47,20 @@ class Document:
         events = [Event(**e) for e in doc["events"]]
         return cls(doc_id, entities, events)
 
+    @classmethod
+    def from_store(cls, store, key, tokens=None):
+        """Read document from document store.
+
+        :param store: document store, see utils.common.open_store,
+            or a columnar store, see utils.narrative.columnar.
+        :param key: document key.
+        :param tokens: tokens of the original text.
+        """
+        if hasattr(store, "document"):
+            # Columnar stores build documents without json parsing
+            return store.document(key)
+        return cls.from_json(json.loads(store.read(key)), tokens)
+
     def to_json(self):
         """Convert document to json object."""
         return {
@@ -45,15 +69,39 @@ class Document:
             "events": [_.to_json() for _ in self.events],
         }
 
+    @property
+    def chain_index(self):
+        """Inverted index, ent_id -> list of (event, role of the entity).
+
+        Built in one pass over events on first use, and reused afterwards,
+        so events should not be changed after that.
+        """
+        if self._chain_index is None:
+            index = {}
+            for event in self.events:
+                seen = set()
+                for r in event.roles:
+                    # Same as Event.find_role, use the first role of each entity
+                    if r.ent_id is not None and r.ent_id not in seen:
+                        seen.add(r.ent_id)
+                        index.setdefault(r.ent_id, []).append((event, r.role))
+            self._chain_index = index
+        return self._chain_index
+
     def get_chain_by_entity_id(self, entity, stoplist=None):
         """Get chain by entity id."""
+        events = self.chain_index.get(entity.ent_id, [])
         if stoplist is None:
-            return [e for e in self.events if e.contains(entity)]
+            return [e for e, role in events]
         else:
-            return [e for e in self.events if e.contains(entity) and e.predicate_gr(entity) not in stoplist]
+            if not isinstance(stoplist, frozenset):
+                stoplist = frozenset(stoplist)
+            return [e for e, role in events if (e.pb_frame, role) not in stoplist]
 
     def get_chains(self, stoplist=None):
         """Get entities and chains."""
+        if stoplist is not None and not isinstance(stoplist, frozenset):
+            stoplist = frozenset(stoplist)
         for entity in self.entities:
             yield entity, self.get_chain_by_entity_id(entity, stoplist)
 
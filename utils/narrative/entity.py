@@ -1,12 +1,13 @@
 """Entity class."""
 
 import os
+from functools import lru_cache
 
 
 # Pronouns
 from collections import Counter
 
-PRONOUNS = [
+PRONOUNS = frozenset([
     "i", "you", "he", "she", "it", "we", "they",
     "me", "him", "her", "us", "them",
     "myself", "yourself", "himself", "herself", "itself", "ourself", "ourselves", "themselves",
@@ -14,24 +15,50 @@ PRONOUNS = [
     "mine", "yours", "ours", "theirs",
     "this", "that", "those", "these",
     "-", ",",
-]
-# Load stop word list
-with open(os.path.join("data", "english_stopwords.txt"), "r") as f:
-    STOPWORDS = f.read().splitlines()
+])
+# Stop word list, relative to the repository root
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "..", "..", "data", "english_stopwords.txt")
+
+
+@lru_cache(maxsize=None)
+def load_stopwords():
+    """Load stop word list on first use."""
+    with open(STOPWORDS_PATH, "r") as f:
+        return frozenset(f.read().splitlines())
+
+
+@lru_cache(maxsize=None)
+def _filter_words():
+    return PRONOUNS | load_stopwords()
+
+
+def __getattr__(name):
+    # Keep STOPWORDS importable from this module, loaded on first access
+    if name == "STOPWORDS":
+        return load_stopwords()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def filter_words_in_mention(words):
     """Filter stop words and pronouns in mention."""
-    return [w for w in words if w not in PRONOUNS and w not in STOPWORDS]
+    filter_words = _filter_words()
+    return [w for w in words if w not in filter_words]
+
+
+@lru_cache(maxsize=65536)
+def _content_words(mention):
+    """Lower-cased content words of a mention tuple, cached.
+
+    Stop words, pronouns and 1-letter words are filtered.
+    """
+    words = filter_words_in_mention([w.lower() for w in mention])
+    return tuple(w for w in words if len(w) > 1)
 
 
 def get_headword_for_mention(mention):
     """Get headword for mention."""
-    mention = [w.lower() for w in mention]
-    # Filter stop words
-    words = filter_words_in_mention(mention)
-    # Filter 1-letter word
-    words = [w for w in words if len(w) > 1]
+    words = _content_words(tuple(mention))
     # Use the rightmost word as the mention head.
     if len(words) > 0:
         return words[-1]
@@ -42,11 +69,20 @@ def get_headword_for_mention(mention):
 class Entity:
     """Entity class."""
 
+    __slots__ = ("mentions", "ent_id", "head", "salient_mention", "concept")
+
     def __init__(self, mentions, ent_id, head=None, salient_mention=None, concept=None):
+        """Initialize an entity.
+
+        Persisted head and salient_mention are trusted, even if empty,
+        and only computed when missing.
+        """
         self.mentions = mentions
         self.ent_id = ent_id
-        self.head = head or self.get_head()
-        self.salient_mention = salient_mention or self.get_salient_mention()
+        self.head = head if head is not None else self.get_head()
+        if salient_mention is None:
+            salient_mention = self.get_salient_mention()
+        self.salient_mention = salient_mention
         self.concept = concept
 
     def to_json(self):
@@ -78,13 +114,11 @@ class Entity:
 
     def get_salient_mention(self):
         """Get salient mention."""
-        salient_mention = []
+        salient_mention = ()
         for mention in self.mentions:
             # Filter stopwords and pronouns.
-            mention = [w.lower() for w in mention]
-            words = filter_words_in_mention(mention)
-            words = [w for w in words if len(w) > 1]
+            words = _content_words(tuple(mention))
             # Use the longest mention as the salient mention
             if len(words) > len(salient_mention):
                 salient_mention = words
-        return salient_mention
+        return list(salient_mention)
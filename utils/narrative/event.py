@@ -1,14 +1,19 @@
 """Event class."""
+from sys import intern
+
 from utils.narrative.entity import get_headword_for_mention, Entity
 
 
 class Role:
     """Role class."""
 
+    __slots__ = ("role", "value", "concept", "ent_id")
+
     def __init__(self, role, value, concept, ent_id, **kwargs):
-        self.role = role
+        # Role labels and concepts repeat a lot, share one string for each
+        self.role = intern(role)
         self.value = value
-        self.concept = concept
+        self.concept = intern(concept) if isinstance(concept, str) else concept
         self.ent_id = ent_id
 
     def __repr__(self):
@@ -46,8 +51,10 @@ def find_arg(roles, relation, entities):
 class Event:
     """Event class."""
 
+    __slots__ = ("pb_frame", "verb_pos", "sent_id", "roles")
+
     def __init__(self, pb_frame, verb_pos, sent_id, roles):
-        self.pb_frame = pb_frame    # propbank frame
+        self.pb_frame = intern(pb_frame)    # propbank frame
         self.verb_pos = verb_pos
         self.sent_id = sent_id
         self.roles = [Role(**r) for r in roles]
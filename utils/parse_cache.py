@@ -0,0 +1,79 @@
+"""Sentence parse cache: amr graphs of parsed sentences, keyed by sentence hash."""
+import hashlib
+import logging
+import os
+import sqlite3
+
+from utils.common import batchify
+
+
+def sentence_key(sent):
+    """Hash of a tokenized sentence, whitespace normalized."""
+    return hashlib.sha1(" ".join(sent.split()).encode("utf-8")).hexdigest()
+
+
+class ParseCache:
+    """Cache database mapping sentence hashes to penman strings.
+
+    Repeated sentences (bylines, boilerplate, updated stories) are parsed once.
+    Worker processes on one host open the same database file,
+    WAL journal lets them read while another worker writes.
+    Graphs depend on the parser model, remove the database when changing it.
+    """
+
+    # Max number of sentences per query, under the sqlite variable limit
+    QUERY_SIZE = 500
+
+    def __init__(self, db_path, timeout=600):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # The connection is used by one thread at a time,
+        #   but not always the one opened it, e.g. pipeline stage threads
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS graphs ("
+            "key TEXT PRIMARY KEY, "
+            "graph TEXT NOT NULL)")
+        self._conn.commit()
+
+    @classmethod
+    def from_work_dir(cls, work_dir):
+        """Open the parse cache of a work directory."""
+        return cls(os.path.join(work_dir, "amr_cache.sqlite"))
+
+    def __reduce__(self):
+        return self.__class__, (self.db_path,)
+
+    def get_many(self, sents):
+        """Return dict, sentence -> cached graph, of sentences found in cache."""
+        keys = {}
+        for sent in sents:
+            keys.setdefault(sentence_key(sent), []).append(sent)
+        found = {}
+        for chunk in batchify(list(keys), self.QUERY_SIZE):
+            cursor = self._conn.execute(
+                f"SELECT key, graph FROM graphs WHERE key IN ({', '.join(['?'] * len(chunk))})",
+                chunk)
+            for key, graph in cursor:
+                for sent in keys[key]:
+                    found[sent] = graph
+        return found
+
+    def put_many(self, pairs):
+        """Add (sentence, graph) pairs, graphs of cached sentences are kept."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO graphs VALUES (?, ?)",
+                [(sentence_key(sent), graph) for sent, graph in pairs])
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM graphs").fetchone()[0]
+
+
+def log_cache_stats(stats, logger=None):
+    """Log hit rate of the parse cache, counted by batch_parse_amrlib in step 3."""
+    logger = logger or logging.getLogger(__name__)
+    rate = stats["cache_hits"] / stats["sents"] if stats["sents"] > 0 else 0.
+    logger.info(f"Parse cache: {stats['cache_hits']} of {stats['sents']} sentences found "
+                f"({rate:.1%}), {stats['parsed']} parsed.")